@@ -8,23 +8,31 @@ st.set_page_config(
     menu_items={"About": "https://github.com/ugm2/neural-search-demo"},
 )
 
+import copy
+
 import nltk
 from streamlit_option_menu import option_menu
 
+from core.tracing import span, trace
 from interface.components import component_select_pipeline
 from interface.config import pages, session_state_variables
-from interface.utils import load_audio_model
+from interface.utils import load_audio_model, profiling_requested
+
 
-nltk.download("punkt_tab")
-nltk.download("averaged_perceptron_tagger_eng")
+def init_session():
+    with span("nltk.download"):
+        nltk.download("punkt_tab")
+        nltk.download("averaged_perceptron_tagger_eng")
 
-# Initialization of session state
-for key, value in session_state_variables.items():
-    if key not in st.session_state:
-        st.session_state[key] = value
+    # Initialization of session state
+    for key, value in session_state_variables.items():
+        if key not in st.session_state:
+            # Each session gets its own copy of mutable defaults
+            st.session_state[key] = copy.copy(value)
 
-# Init audio model
-st.session_state["audio_model"] = load_audio_model()
+    # Init audio model
+    with span("load_audio_model"):
+        st.session_state["audio_model"] = load_audio_model()
 
 
 def run_demo():
@@ -49,10 +57,15 @@ def run_demo():
                 "nav-link": {"font-size": "20px", "text-align": "left"},
             },
         )
-        component_select_pipeline(navigation)
+        with span("component_select_pipeline"):
+            component_select_pipeline(navigation)
 
     # Draw the correct page
-    pages[selected_page][0](main_page)
+    with span("page", page=selected_page):
+        pages[selected_page][0](main_page)
 
 
-run_demo()
+# Every rerun is traced as a whole when profiling is on
+with trace("rerun", enabled=profiling_requested()):
+    init_session()
+    run_demo()
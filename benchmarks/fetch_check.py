@@ -0,0 +1,259 @@
+"""
+Fetch Check
+
+Runs `ArticleFetcher` against a local `aiohttp` stand-in of article sites, so its network
+behaviour can be checked without touching the internet:
+
+    python -m benchmarks.fetch_check --requests-per-second 10
+
+The stand-in serves plain pages, a page that fails with 503 and a `Retry-After` header a few
+times before it answers, pages with ETag and Last-Modified validators that answer conditional
+requests with 304, and a 404. The checks cover per-host rate limiting, also across concurrent
+fetches, retries that honour `Retry-After`, 304 revalidation and serving cached entries when the
+site is down.
+Every check is printed with its outcome, and the exit status is 1 when one of them failed.
+"""
+
+import argparse
+import asyncio
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+from core.fetch import ArticleFetcher
+
+last_modified = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+def parse_stand_in(url, html):
+    """Text of a stand-in page, without importing newspaper."""
+    return re.sub(r"<[^>]+>", "", html).strip()
+
+
+def _page(text, **headers):
+    return web.Response(
+        text=f"<html><body><p>{text}</p></body></html>",
+        content_type="text/html",
+        headers=headers,
+    )
+
+
+class StandInSite:
+    """`aiohttp.web` stand-in of article sites, served from a background thread."""
+
+    def __init__(self, failures=2, retry_after=1):
+        """
+        :param failures: Number of 503 responses `/flaky` sends before it answers.
+        :param retry_after: `Retry-After` seconds sent with those responses.
+        """
+        self.failures = failures
+        self.retry_after = retry_after
+        # Arrival time and headers of every request, per path
+        self.requests = defaultdict(list)
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+
+    async def _handle(self, request):
+        path = request.path
+        self.requests[path].append((time.monotonic(), dict(request.headers)))
+        if path == "/flaky" and len(self.requests[path]) <= self.failures:
+            return web.Response(
+                status=503, headers={"Retry-After": str(self.retry_after)}
+            )
+        if path == "/missing":
+            return web.Response(status=404)
+        if path == "/etag":
+            if request.headers.get("If-None-Match") == '"v1"':
+                return web.Response(status=304)
+            return _page("etag page", ETag='"v1"')
+        if path == "/modified":
+            if request.headers.get("If-Modified-Since") == last_modified:
+                return web.Response(status=304)
+            return _page("modified page", **{"Last-Modified": last_modified})
+        return _page(f"page {path}")
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get("/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def times(self, path):
+        return [arrival for arrival, _ in self.requests[path]]
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def check(self, name, ok, detail=""):
+        self.failed += not ok
+        print(
+            f"{'ok' if ok else 'FAILED':>6}  {name}"
+            + (f" ({detail})" if detail else "")
+        )
+
+
+def run(args):
+    site = StandInSite(failures=args.failures, retry_after=args.retry_after)
+    site.start()
+    checks = Checks()
+    with tempfile.TemporaryDirectory() as cache_path:
+        fetcher = ArticleFetcher(
+            cache_path=cache_path,
+            max_age=0,
+            requests_per_second=args.requests_per_second,
+            timeout=args.timeout,
+            retries=args.failures,
+            backoff=0.05,
+            parser=parse_stand_in,
+        )
+        pages = [f"{site.url}/page{i}" for i in range(args.pages)]
+        start = time.perf_counter()
+        results = fetcher.fetch(pages + [site.url + "/page0"])
+        print(f"Fetched {args.pages} pages in {time.perf_counter() - start:.2f}s")
+
+        checks.check(
+            "pages are fetched and parsed",
+            all(
+                result["text"] == f"page /page{i}"
+                for i, result in enumerate(results[: args.pages])
+            ),
+        )
+        checks.check(
+            "a URL entered twice is fetched once",
+            len(site.requests["/page0"]) == 1 and results[-1] == results[0],
+        )
+        arrivals = sorted(
+            arrival for i in range(args.pages) for arrival in site.times(f"/page{i}")
+        )
+        gaps = [later - earlier for earlier, later in zip(arrivals, arrivals[1:])]
+        interval = 1 / args.requests_per_second
+        # The limiter spaces out request starts, arrivals jitter by a few milliseconds
+        checks.check(
+            "requests to one host are rate limited",
+            min(gaps, default=interval) >= interval * 0.8,
+            f"smallest gap {min(gaps, default=0) * 1000:.0f} ms, limit {interval * 1000:.0f} ms",
+        )
+
+        # Each fetch runs its own event loop, as in two sessions indexing at the same time
+        threads = [
+            threading.Thread(
+                target=fetcher.fetch,
+                args=([f"{site.url}/thread{t}-{i}" for i in range(args.pages // 2)],),
+            )
+            for t in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        arrivals = sorted(
+            arrival
+            for path in list(site.requests)
+            if path.startswith("/thread")
+            for arrival in site.times(path)
+        )
+        gaps = [later - earlier for earlier, later in zip(arrivals, arrivals[1:])]
+        checks.check(
+            "concurrent fetches share the host's rate limit",
+            min(gaps, default=interval) >= interval * 0.8,
+            f"smallest gap {min(gaps, default=0) * 1000:.0f} ms, limit {interval * 1000:.0f} ms",
+        )
+
+        (flaky,) = fetcher.fetch([site.url + "/flaky"])
+        attempts = site.times("/flaky")
+        waits = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+        checks.check(
+            "503 responses are retried until the page answers",
+            flaky["text"] == "page /flaky" and len(attempts) == args.failures + 1,
+            f"{len(attempts)} attempts",
+        )
+        checks.check(
+            "retries wait for Retry-After",
+            all(wait >= args.retry_after * 0.9 for wait in waits),
+            "waited " + ", ".join(f"{wait:.2f}s" for wait in waits),
+        )
+
+        (missing,) = fetcher.fetch([site.url + "/missing"])
+        checks.check(
+            "404 is an error and is not retried",
+            missing["error"] is not None and len(site.requests["/missing"]) == 1,
+            missing["error"],
+        )
+
+        validated = [site.url + "/etag", site.url + "/modified"]
+        fetcher.fetch(validated)
+        revalidated = fetcher.fetch(validated)
+        etag_headers = site.requests["/etag"][-1][1]
+        modified_headers = site.requests["/modified"][-1][1]
+        checks.check(
+            "stale entries are revalidated with If-None-Match and If-Modified-Since",
+            etag_headers.get("If-None-Match") == '"v1"'
+            and modified_headers.get("If-Modified-Since") == last_modified,
+        )
+        checks.check(
+            "304 responses serve the cached text",
+            [result["text"] for result in revalidated] == ["etag page", "modified page"]
+            and all(result["from_cache"] for result in revalidated),
+        )
+
+        fetcher.max_age = 300
+        fresh = fetcher.fetch(validated)
+        checks.check(
+            "fresh entries are served without a request",
+            all(result["from_cache"] for result in fresh)
+            and len(site.requests["/etag"]) == 2,
+        )
+
+        site.stop()
+        fetcher.max_age = 0
+        fetcher.retries = 0
+        offline = fetcher.fetch([site.url + "/etag", site.url + "/never-fetched"])
+        checks.check(
+            "cached entries are served when the site is down",
+            offline[0]["text"] == "etag page" and offline[0]["error"] is None,
+        )
+        checks.check(
+            "uncached URLs fail when the site is down",
+            offline[1]["text"] is None and offline[1]["error"] is not None,
+            offline[1]["error"],
+        )
+
+    print(
+        f"\n{checks.failed} check(s) failed" if checks.failed else "\nAll checks passed"
+    )
+    return checks.failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--requests-per-second", type=float, default=10)
+    parser.add_argument(
+        "--failures", type=int, default=2, help="503 responses before /flaky answers"
+    )
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--timeout", type=float, default=5)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run(parse_args()) else 0)
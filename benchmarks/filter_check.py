@@ -0,0 +1,94 @@
+"""
+Filter Check
+
+Compares the masks `MetadataIndex` computes from its bitmaps with Haystack's own evaluation of
+the same filters, document by document, on a small list of mixed metadata:
+
+    python -m benchmarks.filter_check
+
+The metadata mixes missing fields, strings, numbers, booleans, None and list values, so both
+the bitmap answers and the document-by-document fallback are covered. Every filter is printed
+with its outcome, and the exit status is 1 when a mask differs.
+"""
+
+import argparse
+import sys
+
+import numpy as np
+from haystack.document_stores.filter_utils import (
+    AndOperation,
+    LogicalFilterClause,
+    NotOperation,
+    OrOperation,
+)
+
+from core.filtering import MetadataIndex, evaluate_condition
+
+metas = [
+    {"source_type": "pdf", "uploaded_at": 10, "tags": ["a", "b"]},
+    {"source_type": "url", "uploaded_at": 20.5},
+    {"source_type": "text", "uploaded_at": 30, "tags": ["b"]},
+    {"uploaded_at": 40},
+    {"source_type": "pdf"},
+    {"source_type": None, "uploaded_at": 50, "flag": True},
+    {"source_type": "audio", "uploaded_at": 60, "flag": False},
+    {"source_type": "url", "uploaded_at": 1, "tags": []},
+    {},
+]
+
+filters = [
+    {"source_type": "pdf"},
+    {"source_type": {"$ne": "pdf"}},
+    {"source_type": ["pdf", "url"]},
+    {"source_type": {"$in": ["pdf", "url"]}},
+    {"source_type": {"$nin": ["pdf", "url"]}},
+    {"uploaded_at": {"$gt": 20}},
+    {"uploaded_at": {"$gte": 20.5, "$lt": 50}},
+    {"uploaded_at": {"$lte": 30}},
+    {"flag": True},
+    {"flag": {"$ne": True}},
+    {"tags": {"$in": ["a"]}},
+    {"tags": {"$nin": ["a"]}},
+    {"$or": [{"source_type": "pdf"}, {"uploaded_at": {"$lt": 15}}]},
+    {"$not": {"source_type": {"$nin": ["pdf"]}}},
+    {"source_type": "url", "uploaded_at": {"$gte": 10}},
+    {"missing": {"$nin": ["x"]}},
+]
+
+
+def reference_match(clause, meta):
+    """Document-by-document evaluation of a parsed filter `clause`."""
+    if isinstance(clause, (AndOperation, OrOperation, NotOperation)):
+        matches = [reference_match(condition, meta) for condition in clause.conditions]
+        if isinstance(clause, AndOperation):
+            return all(matches)
+        return not any(matches) if isinstance(clause, NotOperation) else any(matches)
+    return evaluate_condition(clause, meta)
+
+
+def run(args):
+    metadata = MetadataIndex(metas)
+    failed = 0
+    for filter_ in filters:
+        clause = LogicalFilterClause.parse(filter_)
+        expected = np.array([reference_match(clause, meta) for meta in metas])
+        mask = metadata.mask(filter_)
+        ok = bool((mask == expected).all())
+        failed += not ok
+        detail = (
+            "" if ok else f" (expected {expected.astype(int)}, got {mask.astype(int)})"
+        )
+        if args.verbose or not ok:
+            print(f"{'ok' if ok else 'FAILED':>6}  {filter_}{detail}")
+    print(f"\n{failed} filter(s) failed" if failed else "\nAll filters match")
+    return failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--verbose", action="store_true", help="Print every filter")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run(parse_args()) else 0)
@@ -0,0 +1,476 @@
+"""
+Load Test
+
+Simulates concurrent users searching and indexing against the search and index pipelines,
+with stand-in models so it runs locally without downloading anything:
+
+    python -m benchmarks.load_test --pipeline dense --users 16 --duration 60
+
+Every user runs a closed loop of requests with exponential think time. Queries follow a Zipf
+distribution over a fixed pool of queries, and a share of requests index new documents.
+Throughput, latency percentiles, error rate, CPU and memory are reported every `--interval`
+seconds and summarized at the end.
+"""
+
+import argparse
+import json
+import os
+import resource
+import string
+import threading
+import time
+import zlib
+
+import numpy as np
+from haystack import Pipeline
+from haystack.nodes.ranker.base import BaseRanker
+from haystack.nodes.retriever import DenseRetriever
+
+from core.filtering import FilteredTfidfRetriever, source_types
+from core.latency import LatencyBudget
+from core.passage_store import CompactDocumentStore
+from core.preprocessing import ParallelPreProcessor
+from core.search_index import index, search
+
+percentiles = (50, 90, 95, 99)
+
+
+class StandInEncoder:
+    """
+    Hashing encoder shaped like a BERT encoder.
+
+    Each token goes through `layers` dense layers, so the CPU cost grows with the text length
+    like a transformer's does. Embeddings are deterministic but carry no meaning.
+    """
+
+    def __init__(self, dim=768, layers=4, vocab_size=8192, seed=0):
+        rng = np.random.default_rng(seed)
+        self.dim = dim
+        self.vocab_size = vocab_size
+        self.token_embeddings = rng.standard_normal((vocab_size, dim), dtype=np.float32)
+        self.weights = [
+            rng.standard_normal((dim, dim), dtype=np.float32) / np.sqrt(dim)
+            for _ in range(layers)
+        ]
+
+    def encode(self, texts, max_tokens):
+        embeddings = []
+        for text in texts:
+            token_ids = [
+                zlib.crc32(token.encode("utf-8")) % self.vocab_size
+                for token in text.lower().split()[:max_tokens]
+            ]
+            hidden = self.token_embeddings[token_ids or [0]]
+            for weights in self.weights:
+                hidden = np.tanh(hidden @ weights)
+            embeddings.append(hidden.mean(axis=0))
+        return np.stack(embeddings)
+
+
+class StandInRetriever(DenseRetriever):
+    """Dense retriever with `StandInEncoder` as query and passage encoder."""
+
+    def __init__(self, encoder, document_store=None, top_k=10):
+        super().__init__()
+        self.encoder = encoder
+        self.document_store = document_store
+        self.top_k = top_k
+
+    def embed_queries(self, queries):
+        return self.encoder.encode(queries, max_tokens=64)
+
+    def embed_documents(self, documents):
+        return self.encoder.encode([doc.content for doc in documents], max_tokens=256)
+
+    def retrieve(
+        self,
+        query,
+        filters=None,
+        top_k=None,
+        index=None,
+        headers=None,
+        scale_score=None,
+        document_store=None,
+    ):
+        return self.retrieve_batch(
+            [query],
+            filters=filters,
+            top_k=top_k,
+            index=index,
+            headers=headers,
+            scale_score=scale_score,
+            document_store=document_store,
+        )[0]
+
+    def retrieve_batch(
+        self,
+        queries,
+        filters=None,
+        top_k=None,
+        index=None,
+        headers=None,
+        batch_size=None,
+        scale_score=None,
+        document_store=None,
+    ):
+        document_store = document_store or self.document_store
+        return document_store.query_by_embedding_batch(
+            self.embed_queries(queries),
+            filters=filters,
+            top_k=top_k or self.top_k,
+            index=index,
+            headers=headers,
+            scale_score=True if scale_score is None else scale_score,
+        )
+
+
+class StandInRanker(BaseRanker):
+    """Ranker that encodes every (query, document) pair with `StandInEncoder`, like a cross-encoder."""
+
+    def __init__(self, encoder, top_k=10):
+        super().__init__()
+        self.encoder = encoder
+        self.top_k = top_k
+
+    def predict(self, query, documents, top_k=None):
+        if len(documents) == 0:
+            return []
+        query_embedding = self.encoder.encode([query], max_tokens=64)[0]
+        pair_embeddings = self.encoder.encode(
+            [f"{query} {doc.content}" for doc in documents], max_tokens=320
+        )
+        scores = pair_embeddings @ query_embedding
+        for doc, score in zip(documents, scores):
+            doc.score = float(score)
+        ranked = sorted(documents, key=lambda doc: doc.score, reverse=True)
+        return ranked[: top_k or self.top_k]
+
+    def predict_batch(self, queries, documents, top_k=None, batch_size=None):
+        if len(documents) > 0 and isinstance(documents[0], list):
+            return [
+                self.predict(query, docs, top_k)
+                for query, docs in zip(queries, documents)
+            ]
+        return [self.predict(query, documents, top_k) for query in queries]
+
+
+def build_pipelines(args):
+    """Search and index pipelines shaped like the ones in `core.pipelines`, with stand-in models."""
+    processor = ParallelPreProcessor(
+        split_length=args.split_length, num_processes=args.split_processes
+    )
+    search_pipeline = Pipeline()
+    index_pipeline = Pipeline()
+    index_pipeline.add_node(processor, name="Preprocessor", inputs=["File"])
+    if args.pipeline == "keyword":
+        document_store = CompactDocumentStore(index="documents")
+        retriever = FilteredTfidfRetriever(
+            document_store=document_store, top_k=args.top_k
+        )
+        search_pipeline.add_node(retriever, name="TfidfRetriever", inputs=["Query"])
+        index_pipeline.add_node(
+            document_store, name="DocumentStore", inputs=["Preprocessor"]
+        )
+    else:
+        encoder = StandInEncoder(layers=args.encoder_layers, seed=args.seed)
+        document_store = CompactDocumentStore(
+            index="documents", num_shards=args.num_shards, embedding_dim=encoder.dim
+        )
+        retriever = StandInRetriever(
+            encoder, document_store=document_store, top_k=args.top_k
+        )
+        search_pipeline.add_node(retriever, name="DPRRetriever", inputs=["Query"])
+        index_pipeline.add_node(retriever, name="DPRRetriever", inputs=["Preprocessor"])
+        index_pipeline.add_node(
+            document_store, name="DocumentStore", inputs=["DPRRetriever"]
+        )
+        if args.pipeline == "dense_ranker":
+            ranker = StandInRanker(encoder, top_k=args.top_k)
+            search_pipeline.add_node(ranker, name="Ranker", inputs=["DPRRetriever"])
+    if args.latency_budget_ms:
+        search_pipeline.latency_budget = LatencyBudget(
+            args.latency_budget_ms, top_k=args.top_k
+        )
+    return search_pipeline, index_pipeline
+
+
+class Workload:
+    """
+    Synthetic documents and queries.
+
+    Word frequencies follow Zipf's law like natural language does, and query popularity
+    follows a Zipf distribution with exponent `zipf` over a pool of `unique_queries` queries.
+    """
+
+    def __init__(self, unique_queries, zipf, vocabulary_size=20_000, seed=0):
+        rng = np.random.default_rng(seed)
+        letters = np.array(list(string.ascii_lowercase))
+        self.vocabulary = [
+            "".join(rng.choice(letters, size=rng.integers(3, 10)))
+            for _ in range(vocabulary_size)
+        ]
+        word_weights = 1.0 / np.arange(1, vocabulary_size + 1)
+        self.word_probabilities = word_weights / word_weights.sum()
+        # Queries skip the most frequent words, as people rarely search for stop words
+        self.queries = [
+            " ".join(
+                self.vocabulary[idx]
+                for idx in rng.integers(50, vocabulary_size, size=rng.integers(2, 6))
+            )
+            for _ in range(unique_queries)
+        ]
+        query_weights = 1.0 / np.arange(1, unique_queries + 1) ** zipf
+        self.query_probabilities = query_weights / query_weights.sum()
+        self._doc_id = 0
+        self._lock = threading.Lock()
+
+    def query(self, rng):
+        return self.queries[rng.choice(len(self.queries), p=self.query_probabilities)]
+
+    def documents(self, rng, count):
+        documents = []
+        for _ in range(count):
+            sentences = []
+            for _ in range(rng.integers(3, 16)):
+                words = rng.choice(
+                    self.vocabulary, size=rng.integers(8, 21), p=self.word_probabilities
+                )
+                sentences.append(" ".join(words).capitalize() + ".")
+            with self._lock:
+                doc_id = self._doc_id
+                self._doc_id += 1
+            documents.append(
+                {
+                    "text": " ".join(sentences),
+                    "id": doc_id,
+                    "source_type": str(rng.choice(source_types)),
+                }
+            )
+        return documents
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # Peak instead of current RSS where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+class Recorder:
+    """Collects request outcomes and samples resource usage."""
+
+    def __init__(self):
+        self.requests = []
+        self.samples = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._last_cpu = sum(os.times()[:2])
+        self._last_sample = self._start
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def record(self, kind, start, latency, error=None):
+        with self._lock:
+            self.requests.append((kind, start, latency, error))
+
+    def sample(self):
+        now = time.perf_counter()
+        cpu = sum(os.times()[:2])
+        cpu_percent = (
+            100 * (cpu - self._last_cpu) / max(now - self._last_sample, 1e-9)
+        ) / (os.cpu_count() or 1)
+        self._last_cpu, self._last_sample = cpu, now
+        sample = {
+            "time": now - self._start,
+            "cpu_percent": cpu_percent,
+            "rss_mb": _rss_mb(),
+            "threads": threading.active_count(),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def window(self, start, end):
+        with self._lock:
+            return [req for req in self.requests if start <= req[1] < end]
+
+
+def summarize(requests, duration):
+    """Throughput, error rate and latency percentiles in milliseconds, per request kind."""
+    summary = {}
+    for kind in ("search", "index"):
+        latencies = np.array([req[2] for req in requests if req[0] == kind]) * 1000
+        errors = sum(1 for req in requests if req[0] == kind and req[3] is not None)
+        stats = {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": len(latencies) / duration if duration > 0 else 0.0,
+            "error_rate": errors / len(latencies) if len(latencies) else 0.0,
+        }
+        if len(latencies):
+            for p, value in zip(percentiles, np.percentile(latencies, percentiles)):
+                stats[f"p{p}_ms"] = float(value)
+            stats["max_ms"] = float(latencies.max())
+        summary[kind] = stats
+    return summary
+
+
+def _describe(error):
+    # Pipelines wrap node errors, so the message says more than the type
+    lines = str(error).strip().splitlines() or [""]
+    return f"{type(error).__name__}: {lines[0][:200]}"
+
+
+def user(user_idx, args, workload, pipelines, recorder, deadline):
+    search_pipeline, index_pipeline = pipelines
+    rng = np.random.default_rng(args.seed + 1 + user_idx)
+    while recorder.elapsed() < deadline:
+        start = recorder.elapsed()
+        error = None
+        if rng.random() < args.ingest_ratio:
+            kind = "index"
+            documents = workload.documents(rng, args.ingest_batch)
+            start = recorder.elapsed()
+            try:
+                index(documents, index_pipeline, clear_index=False)
+            except Exception as e:
+                error = _describe(e)
+        else:
+            kind = "search"
+            filters = None
+            if rng.random() < args.filter_ratio:
+                filters = {"source_type": [str(rng.choice(source_types))]}
+            query = workload.query(rng)
+            try:
+                search([query], search_pipeline, filters=filters)
+            except Exception as e:
+                error = _describe(e)
+        recorder.record(kind, start, recorder.elapsed() - start, error)
+        if args.think_time_ms > 0:
+            time.sleep(rng.exponential(args.think_time_ms / 1000))
+
+
+def _format_row(values):
+    return " ".join(f"{value:>10}" for value in values)
+
+
+def run(args):
+    workload = Workload(args.unique_queries, args.zipf, seed=args.seed)
+    pipelines = build_pipelines(args)
+    print(f"Indexing {args.corpus_size} documents...")
+    rng = np.random.default_rng(args.seed)
+    index(workload.documents(rng, args.corpus_size), pipelines[1], clear_index=True)
+
+    recorder = Recorder()
+    deadline = args.warmup + args.duration
+    threads = [
+        threading.Thread(
+            target=user,
+            args=(user_idx, args, workload, pipelines, recorder, deadline),
+            daemon=True,
+        )
+        for user_idx in range(args.users)
+    ]
+    for thread in threads:
+        thread.start()
+
+    header = ["time_s", "search_rps", "p50_ms", "p99_ms", "index_rps"]
+    header += ["errors", "cpu_%", "rss_mb", "threads"]
+    print(_format_row(header))
+    timeline = []
+    window_start = 0.0
+    while window_start < deadline:
+        time.sleep(
+            max(min(window_start + args.interval, deadline) - recorder.elapsed(), 0)
+        )
+        window_end = recorder.elapsed()
+        sample = recorder.sample()
+        stats = summarize(
+            recorder.window(window_start, window_end), window_end - window_start
+        )
+        timeline.append({**sample, "warmup": window_end <= args.warmup, **stats})
+        print(
+            _format_row(
+                [
+                    f"{window_end:.1f}",
+                    f"{stats['search']['throughput_rps']:.1f}",
+                    f"{stats['search'].get('p50_ms', 0):.1f}",
+                    f"{stats['search'].get('p99_ms', 0):.1f}",
+                    f"{stats['index']['throughput_rps']:.2f}",
+                    stats["search"]["errors"] + stats["index"]["errors"],
+                    f"{sample['cpu_percent']:.0f}",
+                    f"{sample['rss_mb']:.0f}",
+                    sample["threads"],
+                ]
+            )
+        )
+        window_start = window_end
+    # Let in-flight requests finish, they count in the summary
+    for thread in threads:
+        thread.join()
+
+    measured = recorder.window(args.warmup, float("inf"))
+    summary = summarize(measured, recorder.elapsed() - args.warmup)
+    errors = {}
+    for _, _, _, error in measured:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    memory = pipelines[1].get_node("DocumentStore").memory_report()
+    print(f"\nSummary after {args.warmup}s warmup ({args.users} users):")
+    print(json.dumps({**summary, "errors": errors, "memory": memory}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "config": vars(args),
+                    "summary": summary,
+                    "errors": errors,
+                    "memory": memory,
+                    "timeline": timeline,
+                },
+                f,
+                indent=2,
+            )
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--pipeline", choices=["keyword", "dense", "dense_ranker"], default="dense"
+    )
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds not measured")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds per report")
+    parser.add_argument("--think-time-ms", type=float, default=100)
+    parser.add_argument(
+        "--ingest-ratio", type=float, default=0.05, help="Share of index requests"
+    )
+    parser.add_argument("--ingest-batch", type=int, default=4)
+    parser.add_argument(
+        "--filter-ratio", type=float, default=0.1, help="Share of filtered searches"
+    )
+    parser.add_argument("--corpus-size", type=int, default=500)
+    parser.add_argument("--unique-queries", type=int, default=1000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument(
+        "--latency-budget-ms",
+        type=float,
+        default=0,
+        help="Plan every search to stay within this p95, see core.latency",
+    )
+    parser.add_argument("--num-shards", type=int, default=4)
+    parser.add_argument("--encoder-layers", type=int, default=4)
+    parser.add_argument("--split-length", type=int, default=100)
+    parser.add_argument("--split-processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the summary and timeline as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,277 @@
+"""
+Bulk Article Fetching
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from core.workers import get_executor
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying, the rest are returned as errors right away
+_retry_statuses = {408, 429, 500, 502, 503, 504}
+
+
+def parse_article(url, html):
+    """Main text of the article page `html`, extracted with newspaper."""
+    # Imported here so only the pool workers pay for it
+    from newspaper import Article
+
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    return article.text
+
+
+def _retry_after(response):
+    """Seconds to wait according to a `Retry-After` header, or None."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class ArticleCache:
+    """
+    On-disk cache of fetched articles, one JSON file per URL.
+
+    Entries keep the extracted text together with the response's ETag and Last-Modified
+    validators, so a stale entry is revalidated with a conditional request instead of
+    being downloaded and parsed again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, url):
+        return os.path.join(
+            self.path, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def get(self, url):
+        try:
+            with open(self._file(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Guard against hash collisions
+        return entry if entry.get("url") == url else None
+
+    def put(self, url, entry):
+        path = self._file(url)
+        # Several sessions may write the same URL, so every writer gets its own temporary file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({**entry, "url": url}, f)
+        os.replace(tmp_path, path)
+
+
+class HostRateLimiter:
+    """
+    Spaces out the requests to each host so at most `rate` of them start per second.
+
+    Start times are reserved on the monotonic clock under a lock, so fetches running in
+    different threads and event loops can share a limiter.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_start = {}
+        self._lock = Lock()
+
+    async def wait(self, host):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = Lock()
+
+
+def shared_rate_limiter(rate):
+    """
+    `HostRateLimiter` of `rate`, shared by every fetch in the process.
+
+    Every fetch runs its own event loop, and sessions indexing at the same time must not add up their rates.
+    """
+    with _rate_limiters_lock:
+        if rate not in _rate_limiters:
+            _rate_limiters[rate] = HostRateLimiter(rate)
+        return _rate_limiters[rate]
+
+
+class ArticleFetcher:
+    """
+    Downloads articles concurrently and extracts their text.
+
+    Requests share one pooled `aiohttp` session, are rate limited per host across the process and
+    retried with exponential backoff on connection errors, timeouts and 408/429/5xx responses.
+    Pages are parsed in the shared worker process pool. With `cache_path`, results are kept on
+    disk: entries younger than `max_age` seconds are used as they are and older ones are
+    revalidated with If-None-Match / If-Modified-Since. A cached entry is also served when
+    revalidation fails.
+    """
+
+    def __init__(
+        self,
+        cache_path=None,
+        max_age=300,
+        max_connections=32,
+        max_connections_per_host=4,
+        requests_per_second=2.0,
+        timeout=10.0,
+        retries=3,
+        backoff=0.5,
+        parser=parse_article,
+        user_agent="Mozilla/5.0 (compatible; neural-search)",
+    ):
+        """
+        :param cache_path: Directory of the on-disk cache. Nothing is cached when None.
+        :param max_age: Seconds a cached entry is used without revalidation.
+        :param max_connections: Size of the connection pool.
+        :param max_connections_per_host: Open connections allowed to a single host.
+        :param requests_per_second: Requests started per second and host, unlimited when 0.
+        :param timeout: Seconds allowed for each request, body included.
+        :param retries: Number of times a failed request is retried.
+        :param backoff: Seconds before the first retry, doubled on every retry.
+        :param parser: Picklable `parser(url, html)` that returns the text of a page.
+        :param user_agent: User-Agent header sent with every request.
+        """
+        self.cache = ArticleCache(cache_path) if cache_path is not None else None
+        self.max_age = max_age
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.requests_per_second = requests_per_second
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.parser = parser
+        self.user_agent = user_agent
+
+    def fetch(self, urls):
+        """
+        Fetch `urls` and return one result dict per URL, in order.
+
+        Results have the `url`, its `text` (None on failure), the `error` message (None on success)
+        and whether the text came `from_cache`.
+        """
+        return asyncio.run(self.fetch_async(urls))
+
+    async def fetch_async(self, urls):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections, limit_per_host=self.max_connections_per_host
+        )
+        async with aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"User-Agent": self.user_agent},
+        ) as session:
+            limiter = shared_rate_limiter(self.requests_per_second)
+            # The same URL entered twice is only fetched once
+            tasks = {}
+            for url in urls:
+                if url not in tasks:
+                    tasks[url] = asyncio.ensure_future(
+                        self._fetch(session, limiter, url)
+                    )
+            await asyncio.gather(*tasks.values())
+        return [dict(tasks[url].result()) for url in urls]
+
+    async def _fetch(self, session, limiter, url):
+        entry = self.cache.get(url) if self.cache is not None else None
+        if entry is not None and time.time() - entry["fetched_at"] < self.max_age:
+            return {
+                "url": url,
+                "text": entry["text"],
+                "error": None,
+                "from_cache": True,
+            }
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            status, html, validators = await self._download(
+                session, limiter, url, headers
+            )
+            if status == 304 and entry is not None:
+                text = entry["text"]
+                # A 304 may leave out validators that are still valid
+                validators = {
+                    key: value or entry.get(key) for key, value in validators.items()
+                }
+            else:
+                loop = asyncio.get_event_loop()
+                text = await loop.run_in_executor(
+                    get_executor(), self.parser, url, html
+                )
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if entry is not None:
+                logger.warning(
+                    "Serving %s from cache, revalidation failed: %s", url, error
+                )
+                return {
+                    "url": url,
+                    "text": entry["text"],
+                    "error": None,
+                    "from_cache": True,
+                }
+            logger.warning("Could not fetch %s: %s", url, error)
+            return {"url": url, "text": None, "error": error, "from_cache": False}
+
+        if self.cache is not None:
+            self.cache.put(url, {"text": text, "fetched_at": time.time(), **validators})
+        return {"url": url, "text": text, "error": None, "from_cache": status == 304}
+
+    async def _download(self, session, limiter, url, headers):
+        """Status, body and cache validators of the response to `url`, retrying transient failures."""
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            await limiter.wait(host)
+            delay = self.backoff * 2**attempt
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status in _retry_statuses and attempt < self.retries:
+                        delay = _retry_after(response) or delay
+                        logger.info("Retrying %s after HTTP %d", url, response.status)
+                    else:
+                        if response.status != 304:
+                            response.raise_for_status()
+                        html = await response.text(errors="replace")
+                        validators = {
+                            "etag": response.headers.get("ETag"),
+                            "last_modified": response.headers.get("Last-Modified"),
+                        }
+                        return response.status, html, validators
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                logger.info("Retrying %s after %s", url, type(e).__name__)
+            await asyncio.sleep(delay)
@@ -0,0 +1,287 @@
+"""
+Metadata Filtering
+"""
+
+import numbers
+from threading import Lock
+
+import numpy as np
+from haystack.document_stores.filter_utils import (
+    AndOperation,
+    EqOperation,
+    GteOperation,
+    GtOperation,
+    InOperation,
+    LogicalFilterClause,
+    LteOperation,
+    LtOperation,
+    NeOperation,
+    NinOperation,
+    NotOperation,
+    OrOperation,
+)
+from haystack.errors import DocumentStoreError
+from haystack.nodes.retriever import TfidfRetriever
+from haystack.schema import Document
+
+source_types = ("text", "url", "pdf", "csv", "image", "audio")
+
+_range_operations = {
+    GtOperation: ("right", 1),
+    GteOperation: ("left", 1),
+    LtOperation: ("left", -1),
+    LteOperation: ("right", -1),
+}
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def evaluate_condition(condition, meta):
+    """Haystack's own evaluation of a comparison `condition`, except that `$nin` needs the field like `$ne`."""
+    if isinstance(condition, NinOperation) and condition.field_name not in meta:
+        return False
+    return condition.evaluate(meta)
+
+
+class MetadataIndex:
+    """
+    Bitmap index over the metadata of a fixed list of documents, used to evaluate Haystack filters.
+
+    Each (field, value) pair keeps the positions of its documents, as a sorted position array while
+    it is sparse and as a boolean bitmap once it is dense, in the manner of roaring bitmaps.
+    Numeric fields also keep their values sorted to answer range filters with a binary search.
+    Fields are indexed on first use, and conditions the index cannot answer (e.g. list values)
+    are evaluated document by document with `evaluate_condition`.
+    """
+
+    def __init__(self, metas):
+        self.metas = metas
+        self.size = len(metas)
+        self._fields = {}
+        self._lock = Lock()
+
+    def _field_items(self, field):
+        """Position and value of every document that has `field`."""
+        if hasattr(self.metas, "field_items"):
+            # Columnar metadata can list a field without building meta dicts
+            return self.metas.field_items(field)
+        return (
+            (pos, meta[field]) for pos, meta in enumerate(self.metas) if field in meta
+        )
+
+    def _build_field(self, field):
+        positions = {}
+        present = np.zeros(self.size, dtype=bool)
+        for pos, value in self._field_items(field):
+            present[pos] = True
+            try:
+                positions.setdefault(value, []).append(pos)
+            except TypeError:
+                # Unhashable values cannot be indexed
+                return None
+        bitmaps = {}
+        for value, value_positions in positions.items():
+            value_positions = np.array(value_positions, dtype=np.int32)
+            if len(value_positions) * value_positions.itemsize > self.size:
+                bitmap = np.zeros(self.size, dtype=bool)
+                bitmap[value_positions] = True
+                bitmaps[value] = bitmap
+            else:
+                bitmaps[value] = value_positions
+        sorted_values = None
+        if all(_is_number(value) for value in positions):
+            present_positions = np.flatnonzero(present)
+            values = np.empty(len(present_positions))
+            for value, value_positions in positions.items():
+                values[np.searchsorted(present_positions, value_positions)] = value
+            order = np.argsort(values, kind="stable")
+            sorted_values = (values[order], present_positions[order])
+        return {"present": present, "bitmaps": bitmaps, "sorted": sorted_values}
+
+    def _get_field(self, field):
+        with self._lock:
+            if field not in self._fields:
+                self._fields[field] = self._build_field(field)
+            return self._fields[field]
+
+    def _to_mask(self, container):
+        if container.dtype == bool:
+            return container
+        mask = np.zeros(self.size, dtype=bool)
+        mask[container] = True
+        return mask
+
+    def _value_mask(self, field_index, values):
+        mask = np.zeros(self.size, dtype=bool)
+        for value in values:
+            try:
+                container = field_index["bitmaps"].get(value)
+            except TypeError:
+                return None
+            if container is not None:
+                mask |= self._to_mask(container)
+        return mask
+
+    def _comparison_mask(self, condition):
+        field_index = self._get_field(condition.field_name)
+        if field_index is None:
+            return None
+        value = condition.comparison_value
+        if isinstance(condition, EqOperation):
+            return self._value_mask(field_index, [value])
+        if isinstance(condition, NeOperation):
+            mask = self._value_mask(field_index, [value])
+            return None if mask is None else field_index["present"] & ~mask
+        if isinstance(condition, (InOperation, NinOperation)):
+            if not isinstance(value, list):
+                return None
+            mask = self._value_mask(field_index, value)
+            if mask is None or isinstance(condition, InOperation):
+                return mask
+            return field_index["present"] & ~mask
+        if type(condition) in _range_operations:
+            if field_index["sorted"] is None or not _is_number(value):
+                return None
+            values, positions = field_index["sorted"]
+            side, direction = _range_operations[type(condition)]
+            split = np.searchsorted(values, value, side=side)
+            selected = positions[split:] if direction > 0 else positions[:split]
+            return self._to_mask(selected)
+        return None
+
+    def _evaluate(self, clause):
+        if isinstance(clause, (AndOperation, OrOperation, NotOperation)):
+            masks = [self._evaluate(condition) for condition in clause.conditions]
+            if isinstance(clause, AndOperation):
+                return np.logical_and.reduce(masks)
+            mask = np.logical_or.reduce(masks)
+            return ~mask if isinstance(clause, NotOperation) else mask
+        mask = self._comparison_mask(clause)
+        if mask is None:
+            mask = np.fromiter(
+                (evaluate_condition(clause, meta) for meta in self.metas),
+                dtype=bool,
+                count=self.size,
+            )
+        return mask
+
+    def mask(self, filters):
+        """Boolean mask of the documents that match Haystack `filters`."""
+        if self.size == 0:
+            return np.zeros(0, dtype=bool)
+        return self._evaluate(LogicalFilterClause.parse(filters))
+
+
+class FilteredTfidfRetriever(TfidfRetriever):
+    """
+    TfidfRetriever that supports metadata filters.
+
+    Filters are evaluated on a `MetadataIndex` built at fit time, and only the matching
+    paragraphs of the tf-idf matrix are scored.
+    """
+
+    def __init__(self, document_store=None, top_k=10, auto_fit=True):
+        self.metadata_indexes = {}
+        super().__init__(document_store=document_store, top_k=top_k, auto_fit=auto_fit)
+
+    def fit(self, document_store, index=None):
+        super().fit(document_store=document_store, index=index)
+        index = index or document_store.index
+        self.metadata_indexes[index] = MetadataIndex(
+            list(self.dataframes[index]["meta"])
+        )
+
+    def retrieve(
+        self,
+        query,
+        filters=None,
+        top_k=None,
+        index=None,
+        headers=None,
+        scale_score=None,
+        document_store=None,
+    ):
+        if not filters:
+            return super().retrieve(
+                query,
+                top_k=top_k,
+                index=index,
+                headers=headers,
+                scale_score=scale_score,
+                document_store=document_store,
+            )
+        return self.retrieve_batch(
+            [query],
+            filters=filters,
+            top_k=top_k,
+            index=index,
+            headers=headers,
+            scale_score=scale_score,
+            document_store=document_store,
+        )[0]
+
+    def retrieve_batch(
+        self,
+        queries,
+        filters=None,
+        top_k=None,
+        index=None,
+        headers=None,
+        batch_size=None,
+        scale_score=None,
+        document_store=None,
+    ):
+        if not filters:
+            return super().retrieve_batch(
+                queries,
+                top_k=top_k,
+                index=index,
+                headers=headers,
+                batch_size=batch_size,
+                scale_score=scale_score,
+                document_store=document_store,
+            )
+        if isinstance(filters, list):
+            raise NotImplementedError(
+                "FilteredTfidfRetriever expects the same filters for every query."
+            )
+        if scale_score:
+            raise NotImplementedError(
+                "TfidfRetriever doesn't support scaling score to the unit interval."
+            )
+        document_store = document_store or self.document_store
+        index = index or document_store.index
+        if self.auto_fit and (
+            index not in self.document_counts
+            or document_store.get_document_count(headers=headers, index=index)
+            != self.document_counts[index]
+        ):
+            self.fit(document_store=document_store, index=index)
+        if self.dataframes.get(index) is None:
+            raise DocumentStoreError(
+                "Retrieval requires dataframe and tf-idf matrix but fit() did not calculate them probably because of an empty document store."
+            )
+        top_k = top_k or self.top_k
+
+        rows = np.flatnonzero(self.metadata_indexes[index].mask(filters))
+        if len(rows) == 0:
+            return [[] for _ in queries]
+        question_vector = self.vectorizer.transform(queries)
+        scores = self.tfidf_matrices[index][rows].dot(question_vector.T).T.toarray()
+        df = self.dataframes[index]
+        all_documents = []
+        for query_scores in scores:
+            top = rows[np.argsort(-query_scores, kind="stable")[:top_k]]
+            all_documents.append(
+                [
+                    Document(
+                        id=df["document_id"].iat[row],
+                        content=df["content"].iat[row],
+                        meta=df["meta"].iat[row],
+                    )
+                    for row in top
+                ]
+            )
+        return all_documents
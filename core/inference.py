@@ -0,0 +1,262 @@
+"""
+CPU Inference Backends
+
+The DPR encoders and the Ranker can run as:
+
+  - `pytorch`: eager PyTorch fp32 (default)
+  - `quantized`: PyTorch with int8 dynamic quantization of the Linear layers
+  - `onnx`: ONNX Runtime with full graph optimizations
+
+Every optimized model is checked against the fp32 model on a few sample inputs.
+If the outputs drift too far the fp32 model is kept.
+"""
+
+import logging
+import os
+import re
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from haystack.nodes.retriever import DensePassageRetriever
+from haystack.schema import Document
+
+logger = logging.getLogger(__name__)
+
+inference_backends = ("pytorch", "quantized", "onnx")
+onnx_path = os.path.join("cache", "onnx")
+
+# Physical cores are usually better than hyperthreads for GEMM-heavy inference
+default_num_threads = max(1, (os.cpu_count() or 2) // 2)
+
+sample_queries = [
+    "who wrote the theory of relativity",
+    "what is the capital of france",
+    "how do vaccines train the immune system",
+]
+sample_passages = [
+    "Albert Einstein developed the theory of relativity, one of the two pillars of modern physics.",
+    "Paris is the capital and most populous city of France.",
+    "Vaccines expose the immune system to an antigen so it can recognise the pathogen later.",
+]
+
+# Minimum cosine similarity between fp32 and optimized embeddings
+min_embedding_similarity = 0.99
+# Maximum absolute difference between fp32 and optimized Ranker scores
+max_score_difference = 0.05
+
+
+class OnnxModel(torch.nn.Module):
+    """Drop-in replacement for a HuggingFace model that runs an exported ONNX graph."""
+
+    def __init__(self, model_path, output_name, config, num_threads):
+        import onnxruntime
+
+        super().__init__()
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.output_name = output_name
+        self.config = config
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None, **kwargs):
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": token_type_ids,
+        }
+        feeds = {name: inputs[name].cpu().numpy() for name in self.input_names}
+        (output,) = self.session.run([self.output_name], feeds)
+        return SimpleNamespace(**{self.output_name: torch.from_numpy(output)})
+
+
+class _ExportWrapper(torch.nn.Module):
+    def __init__(self, model, output_name):
+        super().__init__()
+        self.model = model
+        self.output_name = output_name
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        output = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+            return_dict=True,
+        )
+        return getattr(output, self.output_name)
+
+
+def _export_onnx(model, sample_features, output_name):
+    file_name = re.sub(r"[^\w.-]", "_", model.name_or_path) + f"-{output_name}.onnx"
+    model_path = os.path.join(onnx_path, file_name)
+    if not os.path.isfile(model_path):
+        os.makedirs(onnx_path, exist_ok=True)
+        inputs = tuple(
+            sample_features[name]
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+        )
+        dynamic_axes = {
+            name: {0: "batch", 1: "sequence"}
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+        }
+        dynamic_axes[output_name] = {0: "batch"}
+        torch.onnx.export(
+            _ExportWrapper(model, output_name).eval(),
+            inputs,
+            model_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    return model_path
+
+
+def _optimize_model(model, backend, sample_features, output_name, num_threads):
+    if backend == "quantized":
+        return torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    if backend == "onnx":
+        model_path = _export_onnx(model, sample_features, output_name)
+        return OnnxModel(model_path, output_name, model.config, num_threads)
+    raise ValueError(
+        f"Unknown inference backend '{backend}', use one of {inference_backends}"
+    )
+
+
+def _timed(func, repeats=3):
+    """Output of `func` and its median latency in milliseconds."""
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return output, float(np.median(latencies))
+
+
+def _cosine_similarity(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return np.sum(a * b, axis=1) / (
+        np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    )
+
+
+def _check_backend(backend):
+    if backend not in inference_backends:
+        raise ValueError(
+            f"Unknown inference backend '{backend}', use one of {inference_backends}"
+        )
+
+
+def set_num_threads(num_threads=None):
+    torch.set_num_threads(num_threads or default_num_threads)
+
+
+def optimize_retriever(retriever, backend="pytorch", num_threads=None):
+    """
+    Switch the query and passage encoders of a DensePassageRetriever to `backend`.
+
+    Returns the parity and latency report, or None for the `pytorch` backend.
+    """
+    _check_backend(backend)
+    if backend == "pytorch":
+        return None
+    num_threads = num_threads or default_num_threads
+    set_num_threads(num_threads)
+
+    sample_documents = [Document(content=passage) for passage in sample_passages]
+
+    def embed():
+        # Call the encoders directly so a query embedding cache does not hide them
+        query_embeddings = DensePassageRetriever.embed_queries(
+            retriever, sample_queries
+        )
+        passage_embeddings = retriever.embed_documents(sample_documents)
+        return query_embeddings, passage_embeddings
+
+    (fp32_queries, fp32_passages), fp32_latency = _timed(embed)
+
+    encoders = [
+        (retriever.query_encoder, retriever.query_tokenizer(sample_queries[0])),
+        (retriever.passage_encoder, retriever.passage_tokenizer(sample_passages[0])),
+    ]
+    fp32_models = [encoder.model for encoder, _ in encoders]
+    for encoder, features in encoders:
+        features = {name: torch.tensor([values]) for name, values in features.items()}
+        encoder.model = _optimize_model(
+            encoder.model, backend, features, "pooler_output", num_threads
+        )
+
+    (queries, passages), latency = _timed(embed)
+    similarity = min(
+        _cosine_similarity(fp32_queries, queries).min(),
+        _cosine_similarity(fp32_passages, passages).min(),
+    )
+    report = {
+        "backend": backend,
+        "min_cosine_similarity": float(similarity),
+        "fp32_latency_ms": fp32_latency,
+        "latency_ms": latency,
+        "enabled": bool(similarity >= min_embedding_similarity),
+    }
+    if not report["enabled"]:
+        for (encoder, _), model in zip(encoders, fp32_models):
+            encoder.model = model
+    elif hasattr(retriever, "inference_backend"):
+        # Keeps a shared query embedding cache from mixing the embeddings of both backends
+        retriever.inference_backend = backend
+    logger.info("DPR inference backend report: %s", report)
+    return report
+
+
+def optimize_ranker(ranker, backend="pytorch", num_threads=None):
+    """
+    Switch the cross-encoder of a SentenceTransformersRanker to `backend`.
+
+    Returns the parity and latency report, or None for the `pytorch` backend.
+    """
+    _check_backend(backend)
+    if backend == "pytorch":
+        return None
+    num_threads = num_threads or default_num_threads
+    set_num_threads(num_threads)
+
+    def score():
+        documents = [Document(content=passage) for passage in sample_passages]
+        ranked = ranker.predict(query=sample_queries[0], documents=documents)
+        return {doc.content: doc.score for doc in ranked}
+
+    fp32_scores, fp32_latency = _timed(score)
+
+    fp32_model = ranker.transformer_model
+    features = ranker.transformer_tokenizer(
+        [sample_queries[0]], [sample_passages[0]], return_tensors="pt"
+    )
+    ranker.transformer_model = _optimize_model(
+        fp32_model, backend, dict(features), "logits", num_threads
+    )
+
+    scores, latency = _timed(score)
+    difference = max(abs(fp32_scores[text] - scores[text]) for text in fp32_scores)
+    report = {
+        "backend": backend,
+        "max_score_difference": float(difference),
+        "fp32_latency_ms": fp32_latency,
+        "latency_ms": latency,
+        "enabled": bool(difference <= max_score_difference),
+    }
+    if not report["enabled"]:
+        ranker.transformer_model = fp32_model
+    logger.info("Ranker inference backend report: %s", report)
+    return report
@@ -0,0 +1,143 @@
+"""
+Background Indexing Jobs
+"""
+
+import itertools
+import logging
+import time
+import uuid
+from queue import PriorityQueue
+from threading import Event, Lock, Thread
+
+from core.search_index import IndexingCancelled, index, index_stages
+
+logger = logging.getLogger(__name__)
+
+finished_statuses = ("done", "failed", "cancelled")
+
+
+class IndexingJob:
+    """State of one indexing request, updated by the worker that runs it."""
+
+    def __init__(
+        self, documents, pipeline, clear_index, priority, profile=None, extract=None
+    ):
+        self.id = str(uuid.uuid4())
+        self.documents = documents
+        self.pipeline = pipeline
+        self.clear_index = clear_index
+        self.priority = priority
+        self.profile = profile
+        self.extract = extract
+        self.status = "queued"
+        self.progress = {stage: 0.0 for stage in index_stages(pipeline)}
+        self.result = None
+        self.error = None
+        # Inputs left out by `extract`, e.g. URLs that could not be fetched
+        self.warnings = []
+        self.cancel_event = Event()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in finished_statuses
+
+    def update_progress(self, stage, fraction):
+        self.progress[stage] = fraction
+
+
+class IndexingJobQueue:
+    """
+    Runs indexing jobs on a bounded pool of worker threads.
+
+    Jobs with a lower `priority` value run first, jobs of equal priority run in submission order.
+    Finished jobs are kept for `retention` seconds so their status can still be polled.
+    """
+
+    def __init__(self, max_workers=1, retention=3600):
+        self.retention = retention
+        self._queue = PriorityQueue()
+        self._jobs = {}
+        self._lock = Lock()
+        self._counter = itertools.count()
+        for _ in range(max_workers):
+            Thread(target=self._work, daemon=True).start()
+
+    def submit(
+        self,
+        documents,
+        pipeline,
+        clear_index=True,
+        priority=0,
+        profile=None,
+        extract=None,
+    ):
+        """
+        Queue the indexing of `documents` and return the job id.
+
+        With `extract`, `documents` are raw inputs the job extracts first, see `core.search_index.index`.
+        """
+        job = IndexingJob(documents, pipeline, clear_index, priority, profile, extract)
+        with self._lock:
+            self._forget_old_jobs()
+            self._jobs[job.id] = job
+        self._queue.put((priority, next(self._counter), job))
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or stop a running one at its next batch."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.cancel_event.set()
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                job.documents = None
+                job.extract = None
+        return True
+
+    def _forget_old_jobs(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.retention:
+                del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                if job.finished:
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+            try:
+                job.result = index(
+                    documents=job.documents,
+                    pipeline=job.pipeline,
+                    clear_index=job.clear_index,
+                    progress_callback=job.update_progress,
+                    cancel_event=job.cancel_event,
+                    profile=job.profile,
+                    extract=job.extract,
+                    warning_callback=job.warnings.append,
+                )
+                job.status = "done"
+            except IndexingCancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                logger.exception("Indexing job %s failed", job.id)
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                # Drop the input so finished jobs do not keep large corpora alive
+                job.documents = None
+                job.extract = None
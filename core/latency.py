@@ -0,0 +1,249 @@
+"""
+Latency Budgets
+"""
+
+import logging
+import math
+import time
+from collections import defaultdict, deque
+from threading import Lock
+
+import networkx as nx
+import numpy as np
+from haystack.nodes.ranker.base import BaseRanker
+from haystack.nodes.retriever import BaseRetriever
+
+from core.search_index import run_stages
+
+logger = logging.getLogger(__name__)
+
+
+def _count_documents(documents):
+    return sum(len(docs) if isinstance(docs, list) else 1 for docs in documents)
+
+
+class BudgetPlan:
+    """Node params and skipped nodes of one search, with the latency they are expected to take."""
+
+    __slots__ = ("params", "skip", "estimate", "decisions")
+
+    def __init__(self):
+        self.params = {}
+        self.skip = set()
+        self.estimate = 0.0
+        self.decisions = []
+
+
+class LatencyBudget:
+    """
+    Latency-budget mode of a search pipeline.
+
+    Every search is planned from the recent timings of each node so that it stays within
+    `target_ms` at p95: the retriever's depth, the Ranker's depth and the fan-out of
+    per-document nodes after them (e.g. DocumentToSpeech) are picked per request, and the
+    Ranker or per-document nodes are skipped when not even their minimum fits. A skipped
+    node is run again every `probe_every` searches to refresh its timings. Every decision is logged.
+    """
+
+    def __init__(
+        self,
+        target_ms,
+        top_k=10,
+        max_depth=100,
+        window=100,
+        probe_every=20,
+        min_samples=3,
+    ):
+        """
+        :param target_ms: p95 latency a search should stay within, in milliseconds.
+        :param top_k: Number of results wanted when the budget allows it.
+        :param max_depth: Maximum number of candidates the Ranker reranks per query.
+        :param window: Number of recent timings kept per node.
+        :param probe_every: Number of searches a node stays skipped before it is run again.
+        :param min_samples: Number of timings a node needs before they are trusted.
+        """
+        self.target_ms = target_ms
+        self.top_k = top_k
+        self.max_depth = max_depth
+        self.probe_every = probe_every
+        self.min_samples = min_samples
+        # Seconds per query for retrievers, per input document for the other nodes
+        self._timings = defaultdict(lambda: deque(maxlen=window))
+        self._skipped = defaultdict(int)
+        self._lock = Lock()
+
+    def record(self, node, seconds, units):
+        if units > 0:
+            with self._lock:
+                self._timings[node].append(seconds / units)
+
+    def cost(self, node):
+        """p95 seconds per unit of work of `node`, or None until it has enough timings."""
+        with self._lock:
+            samples = list(self._timings.get(node, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return float(np.percentile(samples, 95))
+
+    def _probe_due(self, node):
+        with self._lock:
+            self._skipped[node] += 1
+            if self._skipped[node] < self.probe_every:
+                return False
+            self._skipped[node] = 0
+            return True
+
+    def _ran(self, node):
+        with self._lock:
+            self._skipped[node] = 0
+
+    def plan(self, pipeline, num_queries):
+        """Depths and skipped nodes for a search of `num_queries` queries."""
+        plan = BudgetPlan()
+        retriever, ranker, per_document = None, None, []
+        for node in nx.topological_sort(pipeline.graph):
+            component = pipeline.graph.nodes[node]["component"]
+            if node == pipeline.root_node:
+                continue
+            if isinstance(component, BaseRetriever):
+                retriever = node
+            elif isinstance(component, BaseRanker):
+                ranker = node
+            else:
+                per_document.append(node)
+
+        remaining = self.target_ms / 1000
+        cost = self.cost(retriever) if retriever is not None else None
+        if cost is not None:
+            remaining -= cost * num_queries
+            plan.estimate += cost * num_queries
+
+        def fan_out(cost_per_result, wanted):
+            if cost_per_result == 0:
+                return wanted
+            return min(
+                wanted, math.floor(max(remaining, 0) / (cost_per_result * num_queries))
+            )
+
+        results = self.top_k
+        ranker_cost = self.cost(ranker) if ranker is not None else None
+        run_ranker = ranker is not None
+        probing = set()
+        document_costs = {node: self.cost(node) for node in per_document}
+        document_cost = sum(
+            cost for cost in document_costs.values() if cost is not None
+        )
+        run_documents = len(per_document) > 0
+        if run_documents and None in document_costs.values():
+            # Time a single document first, these nodes are usually the slowest
+            results = 1
+            for node, cost in document_costs.items():
+                if cost is None:
+                    plan.decisions.append(f"{node} has no timings yet")
+        elif (
+            run_documents and fan_out(document_cost + (ranker_cost or 0), results) == 0
+        ):
+            # Not even one result fits: the Ranker goes first, then the per-document nodes
+            if run_ranker and ranker_cost and fan_out(document_cost, results) > 0:
+                run_ranker = self._probe_due(ranker)
+                probing.update([ranker] if run_ranker else [])
+            else:
+                run_documents = self._probe_due(per_document[0])
+                probing.update(per_document if run_documents else [])
+
+        if run_documents:
+            results = max(
+                fan_out(
+                    document_cost + ((ranker_cost or 0) if run_ranker else 0), results
+                ),
+                1,
+            )
+            remaining -= document_cost * results * num_queries
+            plan.estimate += document_cost * results * num_queries
+            self._ran(per_document[0])
+            suffix = " (probing)" if per_document[0] in probing else ""
+            for node in per_document:
+                plan.decisions.append(f"{node} fan-out {results}{suffix}")
+        else:
+            for node in per_document:
+                plan.skip.add(node)
+                plan.decisions.append(
+                    f"skip {node} ({document_costs[node] * 1000:.0f} ms per document does not fit)"
+                )
+
+        depth = results
+        if run_ranker and ranker_cost is None:
+            plan.decisions.append(f"{ranker} depth {depth} (no timings yet)")
+        elif run_ranker:
+            affordable = fan_out(ranker_cost, max(self.max_depth, results))
+            if affordable >= results:
+                depth = affordable
+            elif ranker not in probing:
+                run_ranker = self._probe_due(ranker)
+                probing.update([ranker] if run_ranker else [])
+            if run_ranker:
+                suffix = " (probing)" if ranker in probing else ""
+                plan.decisions.append(f"{ranker} depth {depth}{suffix}")
+                plan.estimate += ranker_cost * depth * num_queries
+        if run_ranker:
+            self._ran(ranker)
+            plan.params[ranker] = {"top_k": results}
+        elif ranker is not None:
+            plan.skip.add(ranker)
+            plan.decisions.append(
+                f"skip {ranker} ({ranker_cost * 1000:.0f} ms per document does not fit)"
+            )
+        if retriever is not None:
+            plan.params[retriever] = {"top_k": depth}
+            plan.decisions.insert(0, f"{retriever} top_k {depth}")
+
+        logger.info(
+            "Latency budget %d ms for %d queries: %s (estimated p95 %.0f ms)",
+            self.target_ms,
+            num_queries,
+            ", ".join(plan.decisions),
+            plan.estimate * 1000,
+        )
+        return plan
+
+    def stages(self, pipeline, queries, params=None):
+        """`run_stages` of `queries` as planned, recording the time every node takes."""
+        plan = self.plan(pipeline, len(queries))
+        stages = run_stages(
+            pipeline,
+            batch=True,
+            skip=plan.skip,
+            queries=queries,
+            params={**(params or {}), **plan.params},
+        )
+        documents_in = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                node, output = next(stages)
+            except StopIteration:
+                return
+            seconds = time.perf_counter() - start
+            if isinstance(pipeline.get_node(node), BaseRetriever):
+                self.record(node, seconds, len(queries))
+            else:
+                self.record(node, seconds, documents_in)
+            documents_in = _count_documents(output.get("documents", []))
+            yield node, output
+
+
+_budgets = {}
+_budgets_lock = Lock()
+
+
+def shared_latency_budget(key, target_ms, top_k=10):
+    """
+    `LatencyBudget` of the search pipeline identified by `key`, shared by every build of it.
+
+    The app rebuilds pipelines on reruns, and a new budget would have to learn its timings again.
+    """
+    key = (key, target_ms, top_k)
+    with _budgets_lock:
+        if key not in _budgets:
+            _budgets[key] = LatencyBudget(target_ms, top_k=top_k)
+        return _budgets[key]
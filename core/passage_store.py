@@ -0,0 +1,444 @@
+"""
+Compact Passage Store
+"""
+
+import sys
+from array import array
+from collections.abc import MutableMapping
+from copy import deepcopy
+from threading import RLock
+
+import numpy as np
+from haystack.schema import Document
+
+from core.sharded_store import Shard, ShardedInMemoryDocumentStore
+
+
+class InternedColumn:
+    """One metadata field of every row, as codes into a table of distinct values (-1 when missing)."""
+
+    __slots__ = ("values", "codes", "_lookup", "_mutable_codes")
+
+    def __init__(self, num_rows=0):
+        self.values = []
+        self.codes = array("i", [-1]) * num_rows
+        self._lookup = {}
+        self._mutable_codes = set()
+
+    def intern(self, value):
+        try:
+            # Keyed by type too, so 1, 1.0 and True stay distinct values
+            key = (type(value), value)
+            code = self._lookup.get(key)
+        except TypeError:
+            key, code = None, None
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            if key is None:
+                self._mutable_codes.add(code)
+            else:
+                self._lookup[key] = code
+        return code
+
+    def append(self, value=None, missing=True):
+        self.codes.append(-1 if missing else self.intern(value))
+
+    def value(self, row):
+        code = self.codes[row]
+        if code < 0:
+            raise KeyError(row)
+        value = self.values[code]
+        # Readers get their own copy of mutable values
+        return deepcopy(value) if code in self._mutable_codes else value
+
+
+class PassageTable(MutableMapping):
+    """
+    The documents of one index, stored column-wise and keyed by document id.
+
+    Contents live in one UTF-8 buffer addressed by offsets, embeddings in one float32 matrix
+    and metadata in interned columns. Every document gets an integer row, and a `Document`
+    is only built when it is read. Rows are never changed once written, apart from their
+    embedding: updates append a new row and deleted rows are reclaimed by `compacted()`.
+    Writes and row reads hold `lock`, which the tables of one store share.
+    """
+
+    def __init__(self, lock=None):
+        self.lock = lock if lock is not None else RLock()
+        self.ids = []
+        self.rows = {}
+        self.text = bytearray()
+        self.offsets = array("q", [0])
+        self.content_types = InternedColumn()
+        self.columns = {}
+        self.objects = {}
+        self.embeddings = None
+        self.has_embedding = bytearray()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(list(self.rows))
+
+    def __contains__(self, doc_id):
+        return doc_id in self.rows
+
+    def __getitem__(self, doc_id):
+        return self.document(self.rows[doc_id])
+
+    def __setitem__(self, doc_id, document):
+        with self.lock:
+            self._append(doc_id, document)
+
+    def _append(self, doc_id, document):
+        self.rows.pop(doc_id, None)
+        row = len(self.ids)
+        self.ids.append(doc_id)
+        self.rows[doc_id] = row
+        if isinstance(document.content, str):
+            self.text += document.content.encode("utf-8")
+        else:
+            # e.g. table DataFrames, kept as objects
+            self.objects[row] = document.content
+        self.offsets.append(len(self.text))
+        self.content_types.append(document.content_type, missing=False)
+        for field in document.meta:
+            if field not in self.columns:
+                self.columns[field] = InternedColumn(row)
+        for field, column in self.columns.items():
+            column.append(document.meta.get(field), missing=field not in document.meta)
+        self._append_embedding(document.embedding)
+
+    def __delitem__(self, doc_id):
+        # The row itself stays readable for queries still running on shards built before
+        with self.lock:
+            del self.rows[doc_id]
+
+    def _append_embedding(self, embedding):
+        row = len(self.has_embedding)
+        self.has_embedding.append(embedding is not None)
+        if embedding is None:
+            return
+        embedding = np.asarray(embedding, dtype=np.float32)
+        if self.embeddings is None:
+            self.embeddings = np.zeros((row + 1, len(embedding)), np.float32)
+        elif row >= len(self.embeddings):
+            # Grow by doubling so appends stay amortized O(1)
+            grown = np.zeros((2 * (row + 1), self.embeddings.shape[1]), np.float32)
+            grown[: len(self.embeddings)] = self.embeddings
+            self.embeddings = grown
+        self.embeddings[row] = embedding
+
+    def content(self, row):
+        if row in self.objects:
+            return self.objects[row]
+        return self.text[self.offsets[row] : self.offsets[row + 1]].decode("utf-8")
+
+    def meta(self, row):
+        meta = {}
+        with self.lock:
+            for field, column in self.columns.items():
+                if column.codes[row] >= 0:
+                    meta[field] = column.value(row)
+        return meta
+
+    def embedding(self, row):
+        if not self.has_embedding[row]:
+            return None
+        return self.embeddings[row].copy()
+
+    def document(self, row, return_embedding=True, score=None):
+        with self.lock:
+            return Document(
+                id=self.ids[row],
+                content=self.content(row),
+                content_type=self.content_types.value(row),
+                meta=self.meta(row),
+                embedding=self.embedding(row) if return_embedding else None,
+                score=score,
+            )
+
+    def set_embedding(self, doc_id, embedding):
+        with self.lock:
+            row = self.rows[doc_id]
+            if self.embeddings is None or not self.has_embedding[row]:
+                # Re-append the row so the embedding matrix is allocated and grown in one place
+                document = self.document(row)
+                document.embedding = embedding
+                self._append(doc_id, document)
+            else:
+                self.embeddings[row] = embedding
+
+    def update_meta(self, doc_id, meta):
+        with self.lock:
+            document = self.document(self.rows[doc_id])
+            document.meta.update(meta)
+            self._append(doc_id, document)
+
+    def live_rows(self, with_embedding=False):
+        with self.lock:
+            rows = np.array(sorted(self.rows.values()), dtype=np.int64)
+            if with_embedding and len(rows):
+                has_embedding = np.frombuffer(bytes(self.has_embedding), dtype=bool)
+                rows = rows[has_embedding[rows]]
+        return rows
+
+    def compacted(self):
+        """This table without its deleted rows, or the table itself when nothing was deleted."""
+        with self.lock:
+            if len(self.rows) == len(self.ids):
+                return self
+            table = PassageTable(self.lock)
+            for row in self.live_rows():
+                table._append(self.ids[row], self.document(row))
+            return table
+
+    def trim(self):
+        """Drop the spare embedding rows left by growing the matrix."""
+        with self.lock:
+            if self.embeddings is not None and len(self.embeddings) > len(self.ids):
+                self.embeddings = self.embeddings[: len(self.ids)].copy()
+
+    def metas(self, rows):
+        return RowMetas(self, rows)
+
+    def memory_usage(self):
+        """Bytes held by this table."""
+        total = sys.getsizeof(self.ids) + sys.getsizeof(self.rows)
+        total += sum(sys.getsizeof(doc_id) for doc_id in self.ids)
+        total += sys.getsizeof(self.text) + sys.getsizeof(self.offsets)
+        total += sys.getsizeof(self.has_embedding)
+        if self.embeddings is not None:
+            total += self.embeddings.nbytes
+        for column in [self.content_types, *self.columns.values()]:
+            total += sys.getsizeof(column.codes) + sys.getsizeof(column.values)
+            total += sum(_deep_size(value) for value in column.values)
+        total += sum(_deep_size(value) for value in self.objects.values())
+        return total
+
+
+class RowMetas:
+    """Metadata of some rows of a `PassageTable`, readable by `MetadataIndex` without building dicts."""
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, pos):
+        return self.table.meta(self.rows[pos])
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self[pos]
+
+    def field_items(self, field):
+        with self.table.lock:
+            column = self.table.columns.get(field)
+            if column is None:
+                return
+            # Fancy indexing copies, so the buffer of the codes is released before a writer appends
+            codes = np.frombuffer(column.codes, dtype=np.int32)[self.rows]
+        for pos in np.flatnonzero(codes >= 0):
+            yield int(pos), column.values[codes[pos]]
+
+
+class RowDocuments:
+    """Documents of some rows of a `PassageTable`, built on access."""
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, pos):
+        return self.table.document(self.rows[pos])
+
+
+class PassageTables(dict):
+    """`InMemoryDocumentStore.indexes` replacement that keeps every document index in a `PassageTable`."""
+
+    def __init__(self, label_index, lock):
+        super().__init__()
+        self.label_index = label_index
+        self.lock = lock
+
+    def __missing__(self, index):
+        self[index] = {}
+        return self[index]
+
+    def __setitem__(self, index, value):
+        # InMemoryDocumentStore empties an index by assigning a new dict
+        if index != self.label_index and not isinstance(value, PassageTable):
+            table = PassageTable(self.lock)
+            for doc_id, document in value.items():
+                table[doc_id] = document
+            value = table
+        super().__setitem__(index, value)
+
+
+def _deep_size(obj, seen=None):
+    """Approximate bytes held by `obj` and everything it references."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is not None else 0)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(
+            _deep_size(key, seen) + _deep_size(value, seen)
+            for key, value in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_size(vars(obj), seen)
+    return size
+
+
+class CompactDocumentStore(ShardedInMemoryDocumentStore):
+    """
+    ShardedInMemoryDocumentStore that keeps documents in `PassageTable`s instead of `Document` objects.
+
+    Shards are views of the table's embedding matrix, and only the documents returned by a
+    query are built. `memory_report()` compares the table against the `Document` layout.
+    """
+
+    def __init__(
+        self,
+        num_shards=4,
+        index="document",
+        embedding_dim=768,
+        return_embedding=False,
+        similarity="dot_product",
+        progress_bar=True,
+        duplicate_documents="overwrite",
+    ):
+        super().__init__(
+            num_shards=num_shards,
+            index=index,
+            embedding_dim=embedding_dim,
+            return_embedding=return_embedding,
+            similarity=similarity,
+            progress_bar=progress_bar,
+            duplicate_documents=duplicate_documents,
+        )
+        # Tables take the store lock, so queries never read a row while it is being written
+        self.indexes = PassageTables(self.label_index, self._lock)
+
+    def get_document_count(
+        self,
+        filters=None,
+        index=None,
+        only_documents_without_embedding=False,
+        headers=None,
+    ):
+        if filters or only_documents_without_embedding or headers:
+            return super().get_document_count(
+                filters=filters,
+                index=index,
+                only_documents_without_embedding=only_documents_without_embedding,
+                headers=headers,
+            )
+        return len(self.indexes[index or self.index])
+
+    def update_embeddings(
+        self,
+        retriever,
+        index=None,
+        filters=None,
+        update_existing_embeddings=True,
+        batch_size=10_000,
+    ):
+        index = index or self.index
+        documents = self.get_all_documents(index=index, filters=filters)
+        if not update_existing_embeddings:
+            with self._lock:
+                table = self.indexes[index]
+                documents = [
+                    doc
+                    for doc in documents
+                    if doc.id in table and not table.has_embedding[table.rows[doc.id]]
+                ]
+        for start in range(0, len(documents), batch_size):
+            batch = documents[start : start + batch_size]
+            # Only storing the embeddings holds the store lock, computing them does not
+            embeddings = retriever.embed_documents(batch)
+            with self._lock:
+                table = self.indexes[index]
+                for doc, embedding in zip(batch, embeddings):
+                    if doc.id in table:
+                        table.set_embedding(doc.id, embedding)
+                self._invalidate_shards(index)
+
+    def update_document_meta(self, id, meta, index=None):
+        index = index or self.index
+        with self._lock:
+            self.indexes[index].update_meta(id, meta)
+            self._invalidate_shards(index)
+
+    def _compact(self, index, trim=False):
+        # Compacting builds a new table, so queries still running on the old shards are unaffected
+        table = self.indexes[index].compacted()
+        if trim:
+            table.trim()
+        self.indexes[index] = table
+        return table
+
+    def _build_shards(self, index):
+        table = self._compact(index)
+        shards = []
+        for rows in np.array_split(
+            table.live_rows(with_embedding=True), self.num_shards
+        ):
+            if len(rows) == 0:
+                continue
+            if rows[-1] - rows[0] + 1 == len(rows):
+                # A view, the embeddings are not copied
+                embeddings = table.embeddings[rows[0] : rows[-1] + 1]
+            else:
+                embeddings = table.embeddings[rows]
+            if self.similarity == "cosine":
+                embeddings = embeddings / np.linalg.norm(
+                    embeddings, axis=1, keepdims=True
+                )
+            shards.append(
+                Shard(RowDocuments(table, rows), embeddings, metas=table.metas(rows))
+            )
+        return shards
+
+    def _hit_document(self, shard, position, score, return_embedding):
+        return shard.documents.table.document(
+            shard.documents.rows[position],
+            return_embedding=return_embedding,
+            score=score,
+        )
+
+    def memory_report(self, index=None):
+        """
+        Bytes held by the passage table, and what the same documents take as `Document` objects.
+
+        The table is compacted and its spare embedding rows are dropped first.
+        """
+        index = index or self.index
+        with self._lock:
+            table = self._compact(index, trim=True)
+            self._invalidate_shards(index)
+            documents = {doc_id: table[doc_id] for doc_id in table}
+            compact_bytes = table.memory_usage()
+        document_bytes = _deep_size(documents)
+        return {
+            "documents": len(table),
+            "compact_bytes": compact_bytes,
+            "document_bytes": document_bytes,
+            "saved_bytes": document_bytes - compact_bytes,
+            "ratio": document_bytes / compact_bytes if compact_bytes else None,
+        }
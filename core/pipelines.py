@@ -6,12 +6,16 @@ import os
 from pathlib import Path
 
 from haystack import Pipeline
-from haystack.document_stores import InMemoryDocumentStore
-from haystack.nodes.preprocessor import PreProcessor
 from haystack.nodes.ranker import SentenceTransformersRanker
-from haystack.nodes.retriever import DensePassageRetriever, TfidfRetriever
 from text2speech import DocumentToSpeech
 
+from core import inference, query_cache
+from core.filtering import FilteredTfidfRetriever
+from core.latency import shared_latency_budget
+from core.passage_store import CompactDocumentStore
+from core.preprocessing import ParallelPreProcessor
+from core.query_cache import CachedDensePassageRetriever, QueryEmbeddingCache
+
 data_path = "data/"
 audio_path = os.path.join(data_path, "audio")
 os.makedirs(data_path, exist_ok=True)
@@ -19,13 +23,27 @@ os.makedirs(audio_path, exist_ok=True)
 # Ensure proper permissions
 os.chmod(audio_path, 0o777)
 
+# Caches outlive `data_path`, which is wiped whenever the pipeline changes
+cache_path = "cache/"
+# Optional list of frequent queries, one per line, encoded when a dense pipeline is built
+frequent_queries_path = "frequent_queries.txt"
+
 index = "documents"
 
-document_store = InMemoryDocumentStore(index=index)
+document_store = CompactDocumentStore(index=index)
+
+query_embedding_cache = QueryEmbeddingCache(
+    path=os.path.join(cache_path, "query_embeddings.npz")
+)
 
 
 def keyword_search(
-    index="documents", split_word_length=100, top_k=10, audio_output=False
+    index="documents",
+    split_word_length=100,
+    split_overlap=0,
+    top_k=10,
+    audio_output=False,
+    latency_budget_ms=0,
 ):
     """
     **Keyword Search Pipeline**
@@ -36,19 +54,17 @@ def keyword_search(
 
       - Documents that have more lexical overlap with the query are more likely to be relevant
       - Words that occur in fewer documents are more significant than words that occur in many documents
+
+    With `latency_budget_ms`, the number of results read out by `audio_output` adapts to that p95 target, see `core.latency`.
     """
     global document_store
     if index != document_store.index:
-        document_store = InMemoryDocumentStore(index=index)
-    keyword_retriever = TfidfRetriever(document_store=(document_store), top_k=top_k)
-    processor = PreProcessor(
-        clean_empty_lines=True,
-        clean_whitespace=True,
-        clean_header_footer=True,
-        split_by="word",
-        split_length=split_word_length,
-        split_respect_sentence_boundary=True,
-        split_overlap=0,
+        document_store = CompactDocumentStore(index=index)
+    keyword_retriever = FilteredTfidfRetriever(
+        document_store=(document_store), top_k=top_k
+    )
+    processor = ParallelPreProcessor(
+        split_length=split_word_length, split_overlap=split_overlap
     )
     # SEARCH PIPELINE
     search_pipeline = Pipeline()
@@ -70,16 +86,27 @@ def keyword_search(
             doc2speech, name="DocumentToSpeech", inputs=["TfidfRetriever"]
         )
 
+    if latency_budget_ms:
+        search_pipeline.latency_budget = shared_latency_budget(
+            ("keyword_search", index, audio_output),
+            latency_budget_ms,
+            top_k=top_k,
+        )
+
     return search_pipeline, index_pipeline
 
 
 def dense_passage_retrieval(
     index="documents",
     split_word_length=100,
+    split_overlap=0,
     query_embedding_model="facebook/dpr-question_encoder-single-nq-base",
     passage_embedding_model="facebook/dpr-ctx_encoder-single-nq-base",
     top_k=10,
     audio_output=False,
+    inference_backend="pytorch",
+    num_shards=4,
+    latency_budget_ms=0,
 ):
     """
     **Dense Passage Retrieval Pipeline**
@@ -89,22 +116,28 @@ def dense_passage_retrieval(
       - One BERT base model to encode documents
       - One BERT base model to encode queries
       - Ranking of documents done by dot product similarity between query and document embeddings
+
+    The encoders run on CPU with the `inference_backend` of choice: `pytorch`, `quantized` (int8) or `onnx`.
+    Passages are stored column-wise, and their embeddings are split into `num_shards` shards
+    that are searched in parallel.
+    With `latency_budget_ms`, the retrieval depth and the `audio_output` fan-out adapt to that p95 target, see `core.latency`.
     """
-    document_store = InMemoryDocumentStore(index=index)
-    dpr_retriever = DensePassageRetriever(
+    document_store = CompactDocumentStore(index=index, num_shards=num_shards)
+    dpr_retriever = CachedDensePassageRetriever(
+        query_cache=query_embedding_cache,
         document_store=document_store,
         query_embedding_model=query_embedding_model,
         passage_embedding_model=passage_embedding_model,
         top_k=top_k,
     )
-    processor = PreProcessor(
-        clean_empty_lines=True,
-        clean_whitespace=True,
-        clean_header_footer=True,
-        split_by="word",
+    inference.optimize_retriever(dpr_retriever, backend=inference_backend)
+    dpr_retriever.warm_up(query_cache.load_frequent_queries(frequent_queries_path))
+    # Passages are sized to fit the passage encoder's maximum sequence length
+    processor = ParallelPreProcessor(
         split_length=split_word_length,
-        split_respect_sentence_boundary=True,
-        split_overlap=0,
+        split_overlap=split_overlap,
+        tokenizer_name_or_path=passage_embedding_model,
+        max_tokens=dpr_retriever.processor.max_seq_len_passage,
     )
     # SEARCH PIPELINE
     search_pipeline = Pipeline()
@@ -127,17 +160,35 @@ def dense_passage_retrieval(
             document_to_speech, name="DocumentToSpeech", inputs=["DPRRetriever"]
         )
 
+    if latency_budget_ms:
+        search_pipeline.latency_budget = shared_latency_budget(
+            (
+                "dense_passage_retrieval",
+                index,
+                query_embedding_model,
+                audio_output,
+                inference_backend,
+                num_shards,
+            ),
+            latency_budget_ms,
+            top_k=top_k,
+        )
+
     return search_pipeline, index_pipeline
 
 
 def dense_passage_retrieval_ranker(
     index="documents",
     split_word_length=100,
+    split_overlap=0,
     query_embedding_model="facebook/dpr-question_encoder-single-nq-base",
     passage_embedding_model="facebook/dpr-ctx_encoder-single-nq-base",
     ranker_model="cross-encoder/ms-marco-MiniLM-L-12-v2",
     top_k=10,
     audio_output=False,
+    inference_backend="pytorch",
+    num_shards=4,
+    latency_budget_ms=0,
 ):
     """
     **Dense Passage Retrieval Ranker Pipeline**
@@ -147,15 +198,21 @@ def dense_passage_retrieval_ranker(
       - A Ranker reorders a set of Documents based on their relevance to the Query.
       - It is particularly useful when your Retriever has high recall but poor relevance scoring.
       - The improvement that the Ranker brings comes at the cost of some additional computation time.
+
+    With `latency_budget_ms`, the rerank depth adapts to that p95 target and the Ranker is skipped when it does not fit.
     """
     search_pipeline, index_pipeline = dense_passage_retrieval(
         index=index,
         split_word_length=split_word_length,
+        split_overlap=split_overlap,
         query_embedding_model=query_embedding_model,
         passage_embedding_model=passage_embedding_model,
         top_k=top_k,
+        inference_backend=inference_backend,
+        num_shards=num_shards,
     )
     ranker = SentenceTransformersRanker(model_name_or_path=ranker_model, top_k=top_k)
+    inference.optimize_ranker(ranker, backend=inference_backend)
 
     search_pipeline.add_node(ranker, name="Ranker", inputs=["DPRRetriever"])
 
@@ -168,4 +225,19 @@ def dense_passage_retrieval_ranker(
             document_to_speech, name="DocumentToSpeech", inputs=["Ranker"]
         )
 
+    if latency_budget_ms:
+        search_pipeline.latency_budget = shared_latency_budget(
+            (
+                "dense_passage_retrieval_ranker",
+                index,
+                query_embedding_model,
+                ranker_model,
+                audio_output,
+                inference_backend,
+                num_shards,
+            ),
+            latency_budget_ms,
+            top_k=top_k,
+        )
+
     return search_pipeline, index_pipeline
@@ -0,0 +1,230 @@
+"""
+Sentence-aware PreProcessor
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+
+from haystack.nodes import BaseComponent
+from haystack.nodes.preprocessor import PreProcessor
+from haystack.schema import Document
+from nltk.tokenize import sent_tokenize
+from transformers import AutoTokenizer
+
+from core.workers import default_num_processes, get_executor
+
+# Split results are shared by every pipeline built in this process, keyed by content and split settings
+_split_cache = OrderedDict()
+_split_cache_lock = Lock()
+
+# Below this many characters a batch is split inline, sending it to the workers would take longer
+inline_chars = 20_000
+
+# Per-process cleaner and tokenizers, used both by pool workers and for inline splitting
+_cleaner = []
+_tokenizers = {}
+
+
+def _get_worker_state(tokenizer_name_or_path):
+    if len(_cleaner) == 0:
+        _cleaner.append(
+            PreProcessor(
+                clean_empty_lines=True,
+                clean_whitespace=True,
+                clean_header_footer=True,
+                split_by=None,
+                progress_bar=False,
+            )
+        )
+    if tokenizer_name_or_path not in _tokenizers:
+        tokenizer = None
+        if tokenizer_name_or_path is not None:
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path)
+        _tokenizers[tokenizer_name_or_path] = tokenizer
+    return _cleaner[0], _tokenizers[tokenizer_name_or_path]
+
+
+def _measure(sentences, tokenizer):
+    """Number of tokens and words of each sentence."""
+    words = [len(sentence.split()) for sentence in sentences]
+    if tokenizer is None:
+        return words, words
+    input_ids = tokenizer(sentences, add_special_tokens=False)["input_ids"]
+    return [len(ids) for ids in input_ids], words
+
+
+def _split_long_sentence(sentence, n_tokens, max_tokens, split_length):
+    # Word windows sized by the sentence's average tokens per word
+    words = sentence.split()
+    step = max(1, min(split_length, len(words) * max_tokens // max(n_tokens, 1)))
+    return [" ".join(words[i : i + step]) for i in range(0, len(words), step)]
+
+
+def split_text(text, tokenizer_name_or_path, split_length, split_overlap, max_tokens):
+    """Clean `text` and pack its sentences into passages of at most `max_tokens` tokens and `split_length` words."""
+    cleaner, tokenizer = _get_worker_state(tokenizer_name_or_path)
+    text = cleaner.clean(
+        Document(content=text),
+        clean_whitespace=True,
+        clean_header_footer=True,
+        clean_empty_lines=True,
+    ).content
+    sentences = [sentence for sentence in sent_tokenize(text) if sentence.strip()]
+    if len(sentences) == 0:
+        return []
+    if tokenizer is not None:
+        # Leave room for the special tokens the encoder adds around the passage
+        max_tokens -= tokenizer.num_special_tokens_to_add(pair=True)
+    else:
+        max_tokens = split_length
+
+    units = []
+    for sentence, n_tokens, n_words in zip(sentences, *_measure(sentences, tokenizer)):
+        if n_tokens > max_tokens or n_words > split_length:
+            pieces = _split_long_sentence(sentence, n_tokens, max_tokens, split_length)
+            units.extend(zip(pieces, *_measure(pieces, tokenizer)))
+        else:
+            units.append((sentence, n_tokens, n_words))
+
+    passages = []
+    current = []
+    for unit in units:
+        if current and (
+            sum(u[1] for u in current) + unit[1] > max_tokens
+            or sum(u[2] for u in current) + unit[2] > split_length
+        ):
+            passages.append(" ".join(u[0] for u in current))
+            # Carry trailing sentences over as overlap, as long as the next sentence still fits
+            overlap = []
+            for previous in reversed(current):
+                if sum(u[1] for u in overlap) + previous[1] > split_overlap:
+                    break
+                overlap.insert(0, previous)
+            while overlap and (
+                sum(u[1] for u in overlap) + unit[1] > max_tokens
+                or sum(u[2] for u in overlap) + unit[2] > split_length
+            ):
+                overlap.pop(0)
+            current = overlap
+        current.append(unit)
+    if current:
+        passages.append(" ".join(u[0] for u in current))
+    return passages
+
+
+def split_texts(texts, *args):
+    return [split_text(text, *args) for text in texts]
+
+
+class ParallelPreProcessor(BaseComponent):
+    """
+    Cleans Documents and splits them into passages at sentence boundaries.
+
+    Passages are sized with the encoder's own tokenizer so they fit its maximum sequence length,
+    large batches of Documents are split across worker processes and split results are cached by content hash.
+    """
+
+    outgoing_edges = 1
+
+    def __init__(
+        self,
+        split_length=100,
+        split_overlap=0,
+        tokenizer_name_or_path=None,
+        max_tokens=512,
+        num_processes=None,
+        cache_size=10_000,
+    ):
+        """
+        :param split_length: Maximum number of words per passage.
+        :param split_overlap: Number of tokens (words when no tokenizer is given) repeated between consecutive passages.
+        :param tokenizer_name_or_path: Tokenizer used to count passage length, usually the passage encoder's.
+        :param max_tokens: Maximum sequence length of the encoder, special tokens included.
+        :param num_processes: Number of chunks a large batch is split in, each one runs in a worker process
+            of the shared pool. Defaults to the size of that pool, 1 splits inline.
+        :param cache_size: Number of split documents kept in the cache.
+        """
+        super().__init__()
+        self.split_length = split_length
+        self.split_overlap = split_overlap
+        self.tokenizer_name_or_path = tokenizer_name_or_path
+        self.max_tokens = max_tokens
+        self.num_processes = num_processes or default_num_processes
+        self.cache_size = cache_size
+
+    def _cache_key(self, text):
+        settings = json.dumps(
+            [
+                self.tokenizer_name_or_path,
+                self.split_length,
+                self.split_overlap,
+                self.max_tokens,
+            ]
+        )
+        return hashlib.sha256((settings + text).encode("utf-8")).hexdigest()
+
+    def _split_texts(self, texts):
+        args = (
+            self.tokenizer_name_or_path,
+            self.split_length,
+            self.split_overlap,
+            self.max_tokens,
+        )
+        num_chunks = min(self.num_processes, len(texts))
+        if num_chunks == 1 or sum(len(text) for text in texts) < inline_chars:
+            return split_texts(texts, *args)
+        # One task per chunk rather than per text keeps the pickling round trips down
+        chunk_size = -(-len(texts) // num_chunks)
+        executor = get_executor()
+        futures = [
+            executor.submit(split_texts, texts[i : i + chunk_size], *args)
+            for i in range(0, len(texts), chunk_size)
+        ]
+        return [passages for future in futures for passages in future.result()]
+
+    def process(self, documents):
+        keys = [self._cache_key(doc.content) for doc in documents]
+        cached = {}
+        with _split_cache_lock:
+            for key in keys:
+                if key in _split_cache:
+                    _split_cache.move_to_end(key)
+                    cached[key] = _split_cache[key]
+        missing = list(
+            {
+                key: doc.content
+                for key, doc in zip(keys, documents)
+                if key not in cached
+            }.items()
+        )
+        if missing:
+            split_results = self._split_texts([text for _, text in missing])
+            with _split_cache_lock:
+                for (key, _), passages in zip(missing, split_results):
+                    cached[key] = passages
+                    _split_cache[key] = passages
+                    _split_cache.move_to_end(key)
+                while len(_split_cache) > self.cache_size:
+                    _split_cache.popitem(last=False)
+
+        split_documents = []
+        for key, doc in zip(keys, documents):
+            for split_id, passage in enumerate(cached[key]):
+                split_documents.append(
+                    Document(
+                        content=passage,
+                        meta={**doc.meta, "_split_id": split_id},
+                        id_hash_keys=["content", "meta"],
+                    )
+                )
+        return split_documents
+
+    def run(self, documents):  # type: ignore
+        return {"documents": self.process(documents)}, "output_1"
+
+    def run_batch(self, documents):  # type: ignore
+        if len(documents) > 0 and isinstance(documents[0], list):
+            documents = [doc for docs in documents for doc in docs]
+        return self.run(documents)
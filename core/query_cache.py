@@ -0,0 +1,186 @@
+"""
+Query Embedding Cache
+"""
+
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+from haystack.nodes.retriever import DensePassageRetriever
+
+from core.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    # DPR tokenizers are always loaded with do_lower_case=True, so case and spacing do not change the embedding
+    return " ".join(query.split()).lower()
+
+
+def load_frequent_queries(path):
+    """Queries listed in the file at `path`, one per line, or none when it does not exist."""
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings keyed by (query encoder model, normalized query).
+
+    When `path` is given the cache is loaded from it on creation and written back
+    every `save_every` new embeddings and on `save()`.
+    """
+
+    def __init__(self, max_size=10_000, path=None, save_every=100):
+        self.max_size = max_size
+        self.path = path
+        self.save_every = save_every
+        self._embeddings = OrderedDict()
+        self._unsaved = 0
+        self._lock = Lock()
+        if self.path is not None and os.path.isfile(self.path):
+            self.load()
+
+    def __len__(self):
+        return len(self._embeddings)
+
+    def get_many(self, model, queries):
+        """Cached embedding of each query, or None when it is not cached."""
+        embeddings = []
+        with self._lock:
+            for query in queries:
+                key = (model, normalize_query(query))
+                embedding = self._embeddings.get(key)
+                if embedding is not None:
+                    self._embeddings.move_to_end(key)
+                embeddings.append(embedding)
+        return embeddings
+
+    def put_many(self, model, queries, embeddings):
+        with self._lock:
+            for query, embedding in zip(queries, embeddings):
+                key = (model, normalize_query(query))
+                self._embeddings[key] = np.asarray(embedding, dtype=np.float32)
+                self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.max_size:
+                self._embeddings.popitem(last=False)
+            self._unsaved += len(queries)
+            should_save = self.path is not None and self._unsaved >= self.save_every
+        if should_save:
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            keys = list(self._embeddings.keys())
+            embeddings = list(self._embeddings.values())
+            self._unsaved = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Several sessions may save at once, so every writer gets its own temporary file
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                keys=np.array(json.dumps(keys)),
+                embeddings=np.stack(embeddings) if embeddings else np.empty((0, 0)),
+            )
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                keys = json.loads(str(data["keys"]))
+                embeddings = data["embeddings"]
+        except Exception as e:
+            # A damaged cache file must not stop the app from starting
+            logger.warning("Ignoring query embedding cache %s: %s", self.path, e)
+            return
+        with self._lock:
+            for (model, query), embedding in zip(keys, embeddings):
+                self._embeddings[(model, query)] = embedding
+            while len(self._embeddings) > self.max_size:
+                self._embeddings.popitem(last=False)
+
+
+class CachedDensePassageRetriever(DensePassageRetriever):
+    """
+    DensePassageRetriever that looks up query embeddings in a `QueryEmbeddingCache`
+    before running the question encoder.
+    """
+
+    def __init__(
+        self,
+        query_cache=None,
+        document_store=None,
+        query_embedding_model="facebook/dpr-question_encoder-single-nq-base",
+        passage_embedding_model="facebook/dpr-ctx_encoder-single-nq-base",
+        max_seq_len_query=64,
+        max_seq_len_passage=256,
+        top_k=10,
+        use_gpu=True,
+        batch_size=16,
+        progress_bar=True,
+    ):
+        # Every parameter is explicit because Haystack looks up recorded init params in this signature
+        super().__init__(
+            document_store=document_store,
+            query_embedding_model=query_embedding_model,
+            passage_embedding_model=passage_embedding_model,
+            max_seq_len_query=max_seq_len_query,
+            max_seq_len_passage=max_seq_len_passage,
+            top_k=top_k,
+            use_gpu=use_gpu,
+            batch_size=batch_size,
+            progress_bar=progress_bar,
+        )
+        self.query_cache = (
+            query_cache if query_cache is not None else QueryEmbeddingCache()
+        )
+        self.query_model_name = str(query_embedding_model)
+        # Set by `core.inference.optimize_retriever`, its embeddings differ slightly from pytorch's
+        self.inference_backend = "pytorch"
+
+    @property
+    def _cache_key(self):
+        if self.inference_backend == "pytorch":
+            return self.query_model_name
+        return f"{self.query_model_name}@{self.inference_backend}"
+
+    def embed_queries(self, queries):
+        cached = self.query_cache.get_many(self._cache_key, queries)
+        missing = list(
+            dict.fromkeys(
+                normalize_query(query)
+                for query, embedding in zip(queries, cached)
+                if embedding is None
+            )
+        )
+        if missing:
+            with span("encode_queries", "DPR", queries=len(missing)):
+                embeddings = super().embed_queries(missing)
+            self.query_cache.put_many(self._cache_key, missing, embeddings)
+            encoded = dict(zip(missing, embeddings))
+            cached = [
+                (encoded[normalize_query(query)] if embedding is None else embedding)
+                for query, embedding in zip(queries, cached)
+            ]
+        return np.stack(cached)
+
+    def warm_up(self, queries, batch_size=None):
+        """Encode `queries` ahead of time so searching for them skips the question encoder."""
+        queries = [query for query in queries if query.strip()]
+        if len(queries) == 0:
+            return
+        for batch in self._get_batches(
+            queries=queries, batch_size=batch_size or self.batch_size
+        ):
+            self.embed_queries(batch)
+        self.query_cache.save()
@@ -1,64 +1,353 @@
+import asyncio
+import contextvars
+import threading
+import time
 import uuid
 
+import networkx as nx
+import numpy as np
 from haystack.document_stores import BaseDocumentStore
+from haystack.errors import DocumentStoreError
+from haystack.nodes.retriever import BaseRetriever, TfidfRetriever
 from haystack.schema import Document
 
+from core.filtering import FilteredTfidfRetriever
+from core.tracing import instrument_pipeline, span, trace
+
+_keyword_retriever_lock = threading.Lock()
+
+# Above this many documents, fitting TF-IDF for the keyword pre-pass of `search_stream`
+# takes longer than the search it is meant to get ahead of, so it only runs when asked for
+keyword_first_max_documents = 10_000
+
 
 def format_docs(documents):
     """Given a list of documents, format the documents and return the documents and doc ids."""
     db_docs: list = []
+    uploaded_at = time.time()
     for doc in documents:
         doc_id = doc["id"] if doc["id"] is not None else str(uuid.uuid4())
         db_doc = {
             "content": doc["text"],
             "content_type": "text",
             "id": str(uuid.uuid4()),
-            "meta": {"id": doc_id},
+            "meta": {
+                "id": doc_id,
+                "source_type": doc.get("source_type", "text"),
+                "uploaded_at": doc.get("uploaded_at", uploaded_at),
+            },
         }
         db_docs.append(Document(**db_doc))
     return db_docs, [doc.meta["id"] for doc in db_docs]
 
 
-def index(documents, pipeline, clear_index=True):
-    documents, doc_ids = format_docs(documents)
-    if clear_index:
-        document_stores = pipeline.get_nodes_by_class(class_type=BaseDocumentStore)
-        for docstore in document_stores:
-            docstore.delete_index(docstore.index)
-    pipeline.run(documents=documents)
+class IndexingCancelled(Exception):
+    pass
+
+
+def run_stages(pipeline, batch=False, skip=(), **inputs):
+    """
+    Run a linear pipeline one node at a time, the way `Pipeline.run` would.
+
+    Yields the node name and its output after every node but the root one.
+    Nodes in `skip` are not run, their input is passed on to the next node.
+    """
+    node_input = {"root_node": pipeline.root_node, "params": {}, **inputs}
+    for node in nx.topological_sort(pipeline.graph):
+        if node in skip:
+            continue
+        component = pipeline.graph.nodes[node]["component"]
+        if batch:
+            node_input, _ = component._dispatch_run_batch(**node_input)
+        else:
+            node_input, _ = component._dispatch_run(**node_input)
+        if node != pipeline.root_node:
+            yield node, node_input
+
+
+def index_stage(component):
+    """Name of the indexing stage a pipeline node belongs to."""
+    if isinstance(component, BaseDocumentStore):
+        return "write"
+    if isinstance(component, BaseRetriever):
+        return "embed"
+    return "split"
+
+
+def index_stages(pipeline):
+    """Ordered indexing stages run by the index pipeline."""
+    stages = ["extract"]
+    for node in nx.topological_sort(pipeline.graph):
+        if node != pipeline.root_node:
+            stages.append(index_stage(pipeline.get_node(node)))
+    return stages
+
+
+def index(
+    documents,
+    pipeline,
+    clear_index=True,
+    batch_size=32,
+    progress_callback=None,
+    cancel_event=None,
+    profile=None,
+    extract=None,
+    warning_callback=None,
+):
+    """
+    Index `documents` with the index pipeline, `batch_size` documents at a time.
+
+    `progress_callback(stage, fraction)` is called as the extract, split, embed and write stages advance.
+    Setting `cancel_event` stops indexing between batches by raising `IndexingCancelled`.
+    `profile` turns tracing on or off for this call, see `core.tracing`.
+    With `extract`, `documents` are raw inputs and `extract(documents, progress, warning_callback)`
+    returns their texts as the extract stage, reporting inputs it leaves out to `warning_callback(message)`.
+    Nothing is cleared when no input could be extracted.
+    """
+    progress_callback = progress_callback or (lambda stage, fraction: None)
+    warning_callback = warning_callback or (lambda message: None)
+    instrument_pipeline(pipeline)
+    with trace("index", enabled=profile, documents=len(documents)):
+        with span("extract"):
+            if extract is not None:
+                documents = extract(
+                    documents,
+                    lambda fraction: progress_callback("extract", fraction),
+                    warning_callback,
+                )
+                if len(documents) == 0:
+                    return []
+            documents, doc_ids = format_docs(documents)
+        progress_callback("extract", 1.0)
+        if clear_index:
+            document_stores = pipeline.get_nodes_by_class(class_type=BaseDocumentStore)
+            for docstore in document_stores:
+                docstore.delete_index(docstore.index)
+
+        batches = [
+            documents[i : i + batch_size] for i in range(0, len(documents), batch_size)
+        ]
+        for batch_idx, batch in enumerate(batches):
+            if cancel_event is not None and cancel_event.is_set():
+                raise IndexingCancelled()
+            with span("batch", batch=batch_idx, documents=len(batch)):
+                for node, _ in run_stages(pipeline, documents=batch):
+                    component = pipeline.get_node(node)
+                    progress_callback(
+                        index_stage(component), (batch_idx + 1) / len(batches)
+                    )
     return doc_ids
 
 
-def search(queries, pipeline):
-    results = []
-    matches_queries = pipeline.run_batch(queries=queries)
-    for matches in matches_queries["documents"]:
-        query_results = []
-        score_is_empty = False
-        for res in matches:
-            if not score_is_empty:
-                score_is_empty = True if res.score is None else False
-
-            # Get the original text from content or meta
-            original_text = res.content
-            if hasattr(res, "meta") and "content_text" in res.meta:
-                original_text = res.meta["content_text"]
-
-            match = {
-                "text": original_text,
-                "id": res.meta["id"],
-                "fragment_id": res.id,
-                "meta": res.meta,
-            }
-            if not score_is_empty:
-                match.update({"score": res.score})
-            if res.content_type == "audio":
-                # Add audio path from the content field
-                match.update({"content_audio": res.content})
-            query_results.append(match)
-        if not score_is_empty:
-            query_results = sorted(
-                query_results, key=lambda x: x["score"], reverse=True
+class SearchResults:
+    """
+    Matches of a batch of queries stored column-wise.
+
+    The matched documents of query `i` are `documents[offsets[i]:offsets[i + 1]]`, already in rank order,
+    and `scores` holds one score per match (NaN for pipelines that do not score, e.g. TF-IDF).
+    Match dicts are only built for the query being accessed.
+    """
+
+    __slots__ = ("documents", "scores", "offsets")
+
+    def __init__(self, documents, scores, offsets):
+        self.documents = documents
+        self.scores = scores
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, query_idx):
+        if query_idx < 0:
+            query_idx += len(self)
+        if not 0 <= query_idx < len(self):
+            raise IndexError("query index out of range")
+        start, end = self.offsets[query_idx], self.offsets[query_idx + 1]
+        return [
+            _to_match(doc, score)
+            for doc, score in zip(self.documents[start:end], self.scores[start:end])
+        ]
+
+    def __iter__(self):
+        for query_idx in range(len(self)):
+            yield self[query_idx]
+
+
+def _to_match(res, score):
+    # Get the original text from content or meta
+    original_text = res.content
+    if "content_text" in res.meta:
+        original_text = res.meta["content_text"]
+
+    match = {
+        "text": original_text,
+        "id": res.meta["id"],
+        "fragment_id": res.id,
+        "meta": res.meta,
+    }
+    if not np.isnan(score):
+        match["score"] = float(score)
+    if res.content_type == "audio":
+        # Add audio path from the content field
+        match["content_audio"] = res.content
+    return match
+
+
+def _rank(scores, top_k=None):
+    """Indices of the `top_k` highest scores in descending order."""
+    if top_k is not None and top_k < len(scores):
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        return top[np.argsort(-scores[top], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+
+def _search_results(matches_queries, top_k=None):
+    """`SearchResults` of the matches of every query, ranked by score."""
+    documents = []
+    scores = []
+    offsets = [0]
+    for matches in matches_queries:
+        query_scores = np.array(
+            [np.nan if res.score is None else res.score for res in matches],
+            dtype=np.float64,
+        )
+        if np.isnan(query_scores).any():
+            # Keep the pipeline's order when any match is not scored
+            order = np.arange(len(matches))[:top_k]
+            query_scores[:] = np.nan
+        else:
+            order = _rank(query_scores, top_k)
+        documents.extend(matches[idx] for idx in order)
+        scores.append(query_scores[order])
+        offsets.append(len(documents))
+    return SearchResults(
+        documents=documents,
+        scores=np.concatenate(scores) if scores else np.empty(0),
+        offsets=offsets,
+    )
+
+
+def search(queries, pipeline, top_k=None, filters=None):
+    """
+    Run `queries` through the search pipeline.
+
+    `filters` are Haystack metadata filters, e.g. `{"source_type": ["pdf", "url"]}`
+    or `{"uploaded_at": {"$gte": timestamp}}`, applied by the retriever while scoring.
+    """
+    params = {"filters": filters} if filters else None
+    instrument_pipeline(pipeline)
+    budget = getattr(pipeline, "latency_budget", None)
+    with trace("search", queries=len(queries)):
+        if budget is None:
+            output = pipeline.run_batch(queries=queries, params=params)
+        else:
+            for _, output in budget.stages(pipeline, queries, params):
+                pass
+        with span("rank"):
+            return _search_results(output["documents"], top_k)
+
+
+def keyword_retriever(document_store):
+    """
+    TF-IDF retriever over `document_store`, created again whenever the store's `version` changes.
+
+    Stores without a version rely on TF-IDF's `auto_fit`, which only notices a new document count.
+    """
+    version = getattr(document_store, "version", None)
+    with _keyword_retriever_lock:
+        cached = getattr(document_store, "_keyword_retriever", None)
+        if cached is None or cached[0] != version:
+            # Fit on creation, re-indexing to the same number of passages needs a new fit too
+            document_store._keyword_retriever = (
+                version,
+                FilteredTfidfRetriever(document_store=document_store),
             )
-        results.append(query_results)
-    return results
+        return document_store._keyword_retriever[1]
+
+
+def _keyword_search(document_store, queries, top_k, filters, keyword_first):
+    """Keyword hits of `queries`, or None when the pre-pass does not apply to this store."""
+    if keyword_first is None:
+        keyword_first = (
+            document_store.get_document_count() <= keyword_first_max_documents
+        )
+    if not keyword_first:
+        return None
+    with span("keyword_search", "FilteredTfidfRetriever"):
+        # Fits TF-IDF the first time and again after the store's version changes
+        retriever = keyword_retriever(document_store)
+        try:
+            return retriever.retrieve_batch(queries, filters=filters, top_k=top_k)
+        except DocumentStoreError:
+            # Nothing to fit TF-IDF on yet
+            return None
+
+
+def _run_in_executor(loop, func, *args):
+    # In a copy of the current context, so the spans `func` records join the current trace
+    return loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+
+
+async def search_stream(
+    queries, pipeline, top_k=None, filters=None, keyword_first=None
+):
+    """
+    Run `queries` through the search pipeline, yielding `(stage, SearchResults)` as the results are refined.
+
+    Results are yielded after every pipeline node that outputs documents, e.g. the retriever,
+    the Ranker and DocumentToSpeech. With `keyword_first`, pipelines that do not start with TF-IDF
+    also run a keyword search of the same document store alongside their first node, and its hits
+    are yielded as the "keyword" stage when they are ready first. By default it only runs for
+    stores of at most `keyword_first_max_documents` documents.
+    """
+    loop = asyncio.get_event_loop()
+    instrument_pipeline(pipeline)
+    params = {"filters": filters} if filters else {}
+    budget = getattr(pipeline, "latency_budget", None)
+    with trace("search", queries=len(queries)):
+        if budget is None:
+            stages = run_stages(pipeline, batch=True, queries=queries, params=params)
+        else:
+            stages = budget.stages(pipeline, queries, params)
+        # Nodes run in the default executor, one at a time, so the event loop stays free
+        next_stage = _run_in_executor(loop, next, stages, None)
+
+        keyword_hits = None
+        retrievers = pipeline.get_nodes_by_class(class_type=BaseRetriever)
+        if (
+            keyword_first is not False
+            and retrievers
+            and not isinstance(retrievers[0], TfidfRetriever)
+        ):
+            keyword_hits = _run_in_executor(
+                loop,
+                _keyword_search,
+                retrievers[0].document_store,
+                queries,
+                top_k,
+                filters,
+                keyword_first,
+            )
+        try:
+            if keyword_hits is not None:
+                await asyncio.wait(
+                    {next_stage, keyword_hits}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if keyword_hits.done() and not next_stage.done():
+                    hits = keyword_hits.result()
+                    if hits is not None:
+                        yield "keyword", _search_results(hits, top_k)
+
+            while True:
+                stage = await next_stage
+                if stage is None:
+                    break
+                next_stage = _run_in_executor(loop, next, stages, None)
+                node, output = stage
+                if "documents" in output:
+                    yield node, _search_results(output["documents"], top_k)
+        finally:
+            if keyword_hits is not None and not keyword_hits.cancel():
+                # It finished after the pipeline's first node, its hits are not needed
+                keyword_hits.exception()
@@ -0,0 +1,242 @@
+"""
+Sharded In-Memory Document Store
+"""
+
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from threading import RLock
+
+import numpy as np
+from haystack.document_stores import InMemoryDocumentStore
+from haystack.schema import Document
+
+from core.filtering import MetadataIndex
+
+# numpy releases the GIL while multiplying matrices, so threads score shards in parallel
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+
+class Shard:
+    __slots__ = ("documents", "embeddings", "metadata")
+
+    def __init__(self, documents, embeddings, metas=None):
+        self.documents = documents
+        self.embeddings = embeddings
+        if metas is None:
+            metas = [doc.meta for doc in documents]
+        self.metadata = MetadataIndex(metas)
+
+
+def _shard_top_k(shard, query_embs, top_k, filters=None):
+    """Scores and shard-local positions of the `top_k` best documents for each query."""
+    rows = None
+    if filters:
+        rows = np.flatnonzero(shard.metadata.mask(filters))
+        if len(rows) == 0:
+            empty = np.empty((len(query_embs), 0))
+            return empty, empty.astype(np.int64)
+        # Only the documents that pass the filters are scored
+        scores = query_embs @ shard.embeddings[rows].T
+    else:
+        scores = query_embs @ shard.embeddings.T
+    k = min(top_k, scores.shape[1])
+    positions = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    scores = np.take_along_axis(scores, positions, axis=1)
+    return scores, positions if rows is None else rows[positions]
+
+
+class ShardedInMemoryDocumentStore(InMemoryDocumentStore):
+    """
+    InMemoryDocumentStore that keeps document embeddings in `num_shards` contiguous float32 blocks.
+
+    Every query is scattered to all shards, each shard returns its own top-k and the results
+    are merged with a heap. Shards are rebuilt, evenly sized, on the first query after
+    documents, embeddings or metadata change. Metadata filters are applied inside each shard
+    through its `MetadataIndex`, so only matching documents are scored. Writes and shard
+    builds hold one store lock, queries only take it to build missing shards.
+    """
+
+    def __init__(
+        self,
+        num_shards=4,
+        index="document",
+        embedding_dim=768,
+        return_embedding=False,
+        similarity="dot_product",
+        progress_bar=True,
+        duplicate_documents="overwrite",
+    ):
+        # Every parameter is explicit because Haystack looks up recorded init params in this signature
+        super().__init__(
+            index=index,
+            embedding_dim=embedding_dim,
+            return_embedding=return_embedding,
+            similarity=similarity,
+            progress_bar=progress_bar,
+            duplicate_documents=duplicate_documents,
+        )
+        self.num_shards = max(1, num_shards)
+        self._shards = {}
+        self._lock = RLock()
+        # Bumped on every change, so caches built from the documents know when they are stale
+        self.version = 0
+
+    def _invalidate_shards(self, index=None):
+        # Callers hold the store lock
+        self._shards.pop(index or self.index, None)
+        self.version += 1
+
+    def write_documents(self, documents, index=None, *args, **kwargs):
+        with self._lock:
+            super().write_documents(documents, index, *args, **kwargs)
+            self._invalidate_shards(index)
+
+    def update_embeddings(self, retriever, index=None, *args, **kwargs):
+        with self._lock:
+            super().update_embeddings(retriever, index, *args, **kwargs)
+            self._invalidate_shards(index)
+
+    def delete_documents(self, index=None, *args, **kwargs):
+        with self._lock:
+            super().delete_documents(index, *args, **kwargs)
+            self._invalidate_shards(index)
+
+    def delete_index(self, index):
+        with self._lock:
+            super().delete_index(index)
+            self._invalidate_shards(index)
+
+    def update_document_meta(self, id, meta, index=None):
+        with self._lock:
+            super().update_document_meta(id, meta, index)
+            self._invalidate_shards(index)
+
+    def _build_shards(self, index):
+        documents = [
+            doc for doc in self.indexes[index].values() if doc.embedding is not None
+        ]
+        shards = []
+        for positions in np.array_split(np.arange(len(documents)), self.num_shards):
+            if len(positions) == 0:
+                continue
+            shard_documents = [documents[pos] for pos in positions]
+            embeddings = np.stack([doc.embedding for doc in shard_documents]).astype(
+                np.float32
+            )
+            if self.similarity == "cosine":
+                embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            shards.append(Shard(shard_documents, embeddings))
+        return shards
+
+    def _get_shards(self, index):
+        shards = self._shards.get(index)
+        if shards is None:
+            with self._lock:
+                shards = self._shards.get(index)
+                if shards is None:
+                    shards = self._shards[index] = self._build_shards(index)
+        return shards
+
+    def _hit_document(self, shard, position, score, return_embedding):
+        """Copy of the document at `position` of `shard`, as returned by a query."""
+        doc = shard.documents[position]
+        return Document(
+            id=doc.id,
+            content=doc.content,
+            content_type=doc.content_type,
+            meta=deepcopy(doc.meta),
+            embedding=doc.embedding if return_embedding else None,
+            score=score,
+        )
+
+    def query_by_embedding(
+        self,
+        query_emb,
+        filters=None,
+        top_k=10,
+        index=None,
+        return_embedding=None,
+        headers=None,
+        scale_score=True,
+    ):
+        if query_emb is None:
+            return super().query_by_embedding(
+                query_emb,
+                filters=filters,
+                top_k=top_k,
+                index=index,
+                return_embedding=return_embedding,
+                headers=headers,
+                scale_score=scale_score,
+            )
+        return self.query_by_embedding_batch(
+            [query_emb],
+            filters=filters,
+            top_k=top_k,
+            index=index,
+            return_embedding=return_embedding,
+            headers=headers,
+            scale_score=scale_score,
+        )[0]
+
+    def query_by_embedding_batch(
+        self,
+        query_embs,
+        filters=None,
+        top_k=10,
+        index=None,
+        return_embedding=None,
+        headers=None,
+        scale_score=True,
+    ):
+        if isinstance(filters, list):
+            # Per-query filters
+            return super().query_by_embedding_batch(
+                query_embs,
+                filters=filters,
+                top_k=top_k,
+                index=index,
+                return_embedding=return_embedding,
+                headers=headers,
+                scale_score=scale_score,
+            )
+        if headers:
+            raise NotImplementedError("InMemoryDocumentStore does not support headers.")
+
+        index = index or self.index
+        if return_embedding is None:
+            return_embedding = self.return_embedding
+
+        query_embs = np.atleast_2d(np.asarray(query_embs, dtype=np.float32))
+        if self.similarity == "cosine":
+            query_embs = query_embs / np.linalg.norm(query_embs, axis=1, keepdims=True)
+
+        shards = self._get_shards(index)
+        if top_k <= 0 or len(shards) == 0:
+            return [[] for _ in query_embs]
+        shard_results = list(
+            _executor.map(
+                lambda shard: _shard_top_k(shard, query_embs, top_k, filters), shards
+            )
+        )
+
+        results = []
+        for query_idx in range(len(query_embs)):
+            candidates = (
+                (float(score), shard_idx, int(position))
+                for shard_idx, (scores, positions) in enumerate(shard_results)
+                for score, position in zip(scores[query_idx], positions[query_idx])
+            )
+            documents = []
+            for score, shard_idx, position in heapq.nlargest(top_k, candidates):
+                if scale_score:
+                    score = self.scale_to_unit_interval(score, self.similarity)
+                documents.append(
+                    self._hit_document(
+                        shards[shard_idx], position, score, return_embedding
+                    )
+                )
+            results.append(documents)
+        return results
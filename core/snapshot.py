@@ -0,0 +1,250 @@
+"""
+Index Snapshots
+
+A snapshot is a directory holding the full state of a pipeline's DocumentStore:
+
+  - `manifest.json`: format version, index name, document count, and the passage encoder and
+    inference backend used
+  - `documents.parquet`: ids, content, content type and meta, written in row groups
+  - `embeddings.npy`: one float32 row per document, loaded back with memory mapping
+"""
+
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from haystack.document_stores import BaseDocumentStore
+from haystack.schema import Document
+
+snapshot_path = "snapshots/"
+snapshot_format_version = 1
+
+manifest_file = "manifest.json"
+documents_file = "documents.parquet"
+embeddings_file = "embeddings.npy"
+
+documents_schema = pa.schema(
+    [
+        ("id", pa.string()),
+        ("content", pa.string()),
+        ("content_type", pa.string()),
+        ("meta", pa.string()),
+        ("has_embedding", pa.bool_()),
+    ]
+)
+
+
+def _get_document_store(pipeline):
+    document_stores = pipeline.get_nodes_by_class(class_type=BaseDocumentStore)
+    if len(document_stores) == 0:
+        raise ValueError("The pipeline has no DocumentStore node")
+    return document_stores[0]
+
+
+def _get_encoder(pipeline):
+    """
+    Name and inference backend of the passage encoder that produces the stored embeddings,
+    or `(None, None)` when the pipeline has none.
+    """
+    for node in pipeline.graph.nodes:
+        component = pipeline.graph.nodes[node]["component"]
+        params = component._component_config.get("params", {})
+        if "passage_embedding_model" in params:
+            # Set by `core.inference.optimize_retriever`, its embeddings differ slightly from pytorch's
+            backend = getattr(component, "inference_backend", "pytorch")
+            return params["passage_embedding_model"], backend
+    return None, None
+
+
+def _snapshot_dir(name):
+    """Directory of snapshot `name`, which must be a plain name inside `snapshot_path`."""
+    # ".tmp" directories hold snapshots being written
+    if (
+        not re.fullmatch(r"[\w.-]+", name)
+        or name in (".", "..")
+        or name.endswith(".tmp")
+    ):
+        raise ValueError(
+            f"Invalid snapshot name '{name}', use letters, digits, '_', '-' and '.'"
+        )
+    root = os.path.realpath(snapshot_path)
+    snapshot_dir = os.path.realpath(os.path.join(root, name))
+    if os.path.dirname(snapshot_dir) != root:
+        raise ValueError(f"Snapshot '{name}' is outside {snapshot_path}")
+    return snapshot_dir
+
+
+def list_snapshots():
+    if not os.path.isdir(snapshot_path):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(snapshot_path)
+        if os.path.isfile(os.path.join(snapshot_path, name, manifest_file))
+    )
+
+
+def save_snapshot(pipeline, name, batch_size=10_000):
+    """Write the state of the pipeline's DocumentStore to `snapshots/<name>`."""
+    document_store = _get_document_store(pipeline)
+    index = document_store.index
+    num_documents = document_store.get_document_count(index=index)
+
+    target_dir = _snapshot_dir(name)
+    tmp_dir = target_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    embeddings = None
+    row = 0
+    writer = pq.ParquetWriter(os.path.join(tmp_dir, documents_file), documents_schema)
+    try:
+        documents = document_store.get_all_documents_generator(
+            index=index, return_embedding=True, batch_size=batch_size
+        )
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) == batch_size:
+                embeddings = _write_batch(
+                    writer, batch, row, embeddings, num_documents, tmp_dir
+                )
+                row += len(batch)
+                batch = []
+        if batch:
+            embeddings = _write_batch(
+                writer, batch, row, embeddings, num_documents, tmp_dir
+            )
+            row += len(batch)
+    finally:
+        writer.close()
+        if embeddings is not None:
+            embeddings.flush()
+            del embeddings
+
+    if row != num_documents:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise RuntimeError(
+            f"Index '{index}' changed while saving the snapshot ({row} != {num_documents} documents)"
+        )
+
+    encoder_name, inference_backend = _get_encoder(pipeline)
+    manifest = {
+        "format_version": snapshot_format_version,
+        "index": index,
+        "num_documents": num_documents,
+        "has_embeddings": os.path.isfile(os.path.join(tmp_dir, embeddings_file)),
+        "passage_embedding_model": encoder_name,
+        "inference_backend": inference_backend,
+    }
+    with open(os.path.join(tmp_dir, manifest_file), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap in the finished snapshot so a crash never leaves a half-written one behind
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.rename(tmp_dir, target_dir)
+    return manifest
+
+
+def _write_batch(writer, batch, row, embeddings, num_documents, snapshot_dir):
+    has_embedding = [doc.embedding is not None for doc in batch]
+    table = pa.Table.from_pydict(
+        {
+            "id": [doc.id for doc in batch],
+            "content": [doc.content for doc in batch],
+            "content_type": [doc.content_type for doc in batch],
+            "meta": [json.dumps(doc.meta, default=str) for doc in batch],
+            "has_embedding": has_embedding,
+        },
+        schema=documents_schema,
+    )
+    writer.write_table(table)
+
+    if any(has_embedding):
+        if embeddings is None:
+            # Rows of documents without embedding stay zero, `has_embedding` tells them apart
+            dim = len(next(doc.embedding for doc in batch if doc.embedding is not None))
+            embeddings = np.lib.format.open_memmap(
+                os.path.join(snapshot_dir, embeddings_file),
+                mode="w+",
+                dtype=np.float32,
+                shape=(num_documents, dim),
+            )
+        for offset, doc in enumerate(batch):
+            if doc.embedding is not None:
+                embeddings[row + offset] = doc.embedding
+    return embeddings
+
+
+def load_snapshot(pipeline, name, clear_index=True, batch_size=10_000):
+    """
+    Restore `snapshots/<name>` into the pipeline's DocumentStore without running any encoder.
+
+    Returns the manifest, with `next_doc_id` set one past the largest integer `meta["id"]` restored.
+    """
+    snapshot_dir = _snapshot_dir(name)
+    with open(os.path.join(snapshot_dir, manifest_file)) as f:
+        manifest = json.load(f)
+    if manifest["format_version"] != snapshot_format_version:
+        raise ValueError(
+            f"Snapshot '{name}' has format version {manifest['format_version']}, "
+            f"expected {snapshot_format_version}"
+        )
+    encoder_name, inference_backend = _get_encoder(pipeline)
+    if manifest["has_embeddings"]:
+        if encoder_name != manifest["passage_embedding_model"]:
+            raise ValueError(
+                f"Snapshot '{name}' was encoded with '{manifest['passage_embedding_model']}', "
+                f"but the pipeline uses '{encoder_name}'"
+            )
+        snapshot_backend = manifest.get("inference_backend", "pytorch")
+        if inference_backend != snapshot_backend:
+            raise ValueError(
+                f"Snapshot '{name}' was encoded with the '{snapshot_backend}' backend, "
+                f"but the pipeline uses '{inference_backend}'"
+            )
+    elif encoder_name is not None and manifest["num_documents"] > 0:
+        # Without embeddings the restored documents could never be retrieved
+        raise ValueError(
+            f"Snapshot '{name}' has no embeddings, but the pipeline retrieves with '{encoder_name}'"
+        )
+
+    document_store = _get_document_store(pipeline)
+    if clear_index:
+        document_store.delete_index(document_store.index)
+
+    embeddings = None
+    if manifest["has_embeddings"]:
+        embeddings = np.load(os.path.join(snapshot_dir, embeddings_file), mmap_mode="r")
+
+    row = 0
+    next_doc_id = 0
+    documents_table = pq.ParquetFile(os.path.join(snapshot_dir, documents_file))
+    for record_batch in documents_table.iter_batches(batch_size=batch_size):
+        columns = record_batch.to_pydict()
+        documents = []
+        for offset, doc_id in enumerate(columns["id"]):
+            embedding = None
+            if embeddings is not None and columns["has_embedding"][offset]:
+                embedding = embeddings[row + offset]
+            documents.append(
+                Document(
+                    id=doc_id,
+                    content=columns["content"][offset],
+                    content_type=columns["content_type"][offset],
+                    meta=json.loads(columns["meta"][offset]),
+                    embedding=embedding,
+                )
+            )
+        document_store.write_documents(documents, index=document_store.index)
+        row += len(documents)
+        for doc in documents:
+            meta_id = doc.meta.get("id")
+            if isinstance(meta_id, int) and not isinstance(meta_id, bool):
+                next_doc_id = max(next_doc_id, meta_id + 1)
+    manifest["next_doc_id"] = next_doc_id
+    return manifest
@@ -0,0 +1,180 @@
+"""
+Tracing and Profiling
+
+Opt-in span tracing of app reruns, searches and indexing runs. Enable it with
+the `NEURAL_SEARCH_PROFILE=1` environment variable, or per request with `?profile=1`.
+
+Each trace is written to `traces/` as a Chrome trace JSON file, which opens in
+chrome://tracing or https://ui.perfetto.dev. Spans also carry OpenTelemetry-style
+trace, span and parent span ids in their args.
+Set `NEURAL_SEARCH_CPROFILE_RATE` (0 to 1) to also dump a cProfile of that share of traces.
+"""
+
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+traces_path = "traces"
+profile_env_var = "NEURAL_SEARCH_PROFILE"
+cprofile_rate_env_var = "NEURAL_SEARCH_CPROFILE_RATE"
+
+# A context variable rather than a thread local, so work handed to other threads can join the
+# trace by running in a copy of the context (`contextvars.copy_context().run`)
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+def profiling_enabled():
+    return os.environ.get(profile_env_var, "").lower() in ("1", "true", "yes")
+
+
+def _cprofile_rate():
+    try:
+        return float(os.environ.get(cprofile_rate_env_var, 0))
+    except ValueError:
+        return 0.0
+
+
+class Trace:
+    """Span tree of one rerun, search or indexing run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.events = []
+        # Open spans per thread
+        self._span_ids = {}
+        self._pid = os.getpid()
+        self._tid = threading.get_ident()
+        self.started_at = time.strftime("%Y%m%d-%H%M%S")
+
+    @contextmanager
+    def span(self, name, category="app", **args):
+        span_id = uuid.uuid4().hex[:16]
+        tid = threading.get_ident()
+        span_ids = self._span_ids.setdefault(tid, [])
+        # The first span of another thread is a child of the span open in the trace's own thread
+        parent_ids = span_ids or self._span_ids.get(self._tid, [])
+        parent_id = parent_ids[-1] if parent_ids else None
+        span_ids.append(span_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            span_ids.pop()
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": start * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": self._pid,
+                    "tid": tid,
+                    "args": {
+                        "trace_id": self.trace_id,
+                        "span_id": span_id,
+                        "parent_span_id": parent_id,
+                        **args,
+                    },
+                }
+            )
+
+    def file_name(self, extension):
+        os.makedirs(traces_path, exist_ok=True)
+        return os.path.join(
+            traces_path,
+            f"{self.started_at}-{self.name}-{self.trace_id[:8]}.{extension}",
+        )
+
+    def save(self):
+        path = self.file_name("json")
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        return path
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def span(name, category="app", **args):
+    """Record a span in the current context's trace, if there is one."""
+    active_trace = current_trace()
+    if active_trace is None:
+        return nullcontext()
+    return active_trace.span(name, category, **args)
+
+
+@contextmanager
+def trace(name, enabled=None, **args):
+    """
+    Trace the enclosed block and write it to `traces/` when it ends.
+
+    Inside another trace this is a span of that trace. `enabled` defaults to the environment variable.
+    """
+    if current_trace() is not None:
+        with span(name, **args):
+            yield
+        return
+    if enabled is None:
+        enabled = profiling_enabled()
+    if not enabled:
+        yield
+        return
+
+    active_trace = Trace(name)
+    token = _current_trace.set(active_trace)
+    profiler = None
+    if random.random() < _cprofile_rate():
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running
+            profiler = None
+    try:
+        with active_trace.span(name, **args):
+            yield
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # Ended in another context, e.g. an async generator closed by the event loop
+            pass
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(active_trace.file_name("prof"))
+        logger.info("Trace written to %s", active_trace.save())
+
+
+def _traced_method(method, name, category):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with span(name, category):
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_pipeline(pipeline):
+    """Record a span around every node run of `pipeline`. Nodes are instrumented only once."""
+    for node in pipeline.graph.nodes:
+        component = pipeline.graph.nodes[node]["component"]
+        if node == pipeline.root_node or getattr(component, "_traced", False):
+            continue
+        category = type(component).__name__
+        for method_name in ("_dispatch_run", "_dispatch_run_batch"):
+            method = getattr(component, method_name)
+            setattr(component, method_name, _traced_method(method, node, category))
+        component._traced = True
@@ -0,0 +1,31 @@
+"""
+Worker Processes
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+# Every worker is a whole interpreter plus the tokenizers and parsers it loads, so few are started
+default_num_processes = min(4, os.cpu_count() or 1)
+
+_executor = []
+_executor_lock = Lock()
+
+
+def get_executor():
+    """
+    The process pool shared by preprocessing and article parsing.
+
+    It is started on first use and lives as long as the app. Workers load what they need lazily.
+    """
+    with _executor_lock:
+        if len(_executor) == 0:
+            _executor.append(
+                ProcessPoolExecutor(
+                    max_workers=default_num_processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            )
+        return _executor[0]
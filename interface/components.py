@@ -1,16 +1,20 @@
 import streamlit as st
 
+from core.inference import inference_backends
+from core.snapshot import list_snapshots, load_snapshot, save_snapshot
+from core.tracing import span
 from interface.draw_pipelines import get_pipeline_graph
 from interface.utils import (
-    extract_text_from_file,
-    extract_text_from_url,
+    file_source_types,
+    get_indexing_queue,
     get_pipelines,
     reset_vars_data,
 )
 
 
 def component_select_pipeline(container):
-    pipeline_names, pipeline_funcs, pipeline_func_parameters = get_pipelines()
+    with span("get_pipelines"):
+        pipeline_names, pipeline_funcs, pipeline_func_parameters = get_pipelines()
     with st.spinner("Loading Pipeline..."):
         with container:
             selected_pipeline = st.selectbox(
@@ -26,28 +30,47 @@ def component_select_pipeline(container):
             st.write("---")
             st.header("Pipeline Parameters")
 
-            # Process audio_output first to ensure top_k is set correctly
+            # Process audio_output and latency_budget_ms first to ensure top_k is set correctly
             audio_output_value = False
+            latency_budget_value = 0
             for parameter, value in pipeline_func_parameters[index_pipe].items():
                 if parameter == "audio_output":
                     audio_output_value = st.checkbox(parameter, value)
                     pipeline_func_parameters[index_pipe][
                         "audio_output"
                     ] = audio_output_value
-                    if audio_output_value:
-                        pipeline_func_parameters[index_pipe]["top_k"] = 3
-                    break
+                elif parameter == "latency_budget_ms":
+                    latency_budget_value = int(
+                        st.number_input(parameter, value=value, min_value=0)
+                    )
+                    pipeline_func_parameters[index_pipe][
+                        "latency_budget_ms"
+                    ] = latency_budget_value
+            # Without a latency budget, audio output is limited to a fixed number of results
+            fixed_audio_top_k = audio_output_value and not latency_budget_value
+            if fixed_audio_top_k:
+                pipeline_func_parameters[index_pipe]["top_k"] = 3
 
             # Then process all other parameters
             for parameter, value in pipeline_func_parameters[index_pipe].items():
-                if parameter == "audio_output":
+                if parameter in ("audio_output", "latency_budget_ms"):
                     continue
+                elif parameter == "inference_backend":
+                    value = st.selectbox(
+                        parameter,
+                        inference_backends,
+                        index=(
+                            inference_backends.index(value)
+                            if value in inference_backends
+                            else 0
+                        ),
+                    )
                 elif isinstance(value, str):
                     value = st.text_input(parameter, value)
                 elif isinstance(value, bool):
                     value = st.checkbox(parameter, value)
                 elif isinstance(value, int):
-                    if parameter == "top_k" and audio_output_value:
+                    if parameter == "top_k" and fixed_audio_top_k:
                         value = 3
                     value = int(st.number_input(parameter, value=value))
                 elif isinstance(value, float):
@@ -62,30 +85,28 @@ def component_select_pipeline(container):
                 )
                 != list(pipeline_func_parameters[index_pipe].values())
             ):
+                # A new session, e.g. a reloaded tab, may still find its indexing job in the URL
+                new_session = st.session_state["pipeline"] is None
                 st.session_state["pipeline_func_parameters"] = pipeline_func_parameters
-                (
-                    search_pipeline,
-                    index_pipeline,
-                ) = pipeline_funcs[
-                    index_pipe
-                ](**pipeline_func_parameters[index_pipe])
+                with span("build_pipeline", pipeline=selected_pipeline):
+                    search_pipeline, index_pipeline = pipeline_funcs[index_pipe](
+                        **pipeline_func_parameters[index_pipe]
+                    )
                 st.session_state["pipeline"] = {
                     "name": selected_pipeline,
                     "search_pipeline": search_pipeline,
                     "index_pipeline": index_pipeline,
                     "doc": pipeline_funcs[index_pipe].__doc__,
                 }
-                reset_vars_data()
+                reset_vars_data(keep_index_job=new_session)
             # TODO: Use elasticsearch and remove this workaround for TFIDF
             # Reload if Keyword Search is selected
             elif st.session_state["pipeline"]["name"] == "Keyword Search":
                 st.session_state["pipeline_func_parameters"] = pipeline_func_parameters
-                (
-                    search_pipeline,
-                    index_pipeline,
-                ) = pipeline_funcs[
-                    index_pipe
-                ](**pipeline_func_parameters[index_pipe])
+                with span("build_pipeline", pipeline=selected_pipeline):
+                    search_pipeline, index_pipeline = pipeline_funcs[index_pipe](
+                        **pipeline_func_parameters[index_pipe]
+                    )
                 st.session_state["pipeline"] = {
                     "name": selected_pipeline,
                     "search_pipeline": search_pipeline,
@@ -102,8 +123,9 @@ def component_show_pipeline(pipeline, pipeline_name):
     with st.expander(expander_text):
         if pipeline["doc"] is not None:
             st.markdown(pipeline["doc"])
-        fig = get_pipeline_graph(pipeline[pipeline_name])
-        st.plotly_chart(fig, use_container_width=True)
+        with span("draw_pipeline", pipeline=pipeline_name):
+            fig = get_pipeline_graph(pipeline[pipeline_name])
+            st.plotly_chart(fig, use_container_width=True)
 
 
 def component_show_search_result(container, results):
@@ -140,29 +162,32 @@ def component_text_input(container, doc_id):
                     st.markdown("---")
                 else:
                     break
-        corpus = [{"text": doc["text"], "id": doc["doc_id"]} for doc in texts]
+        corpus = [
+            {"text": doc["text"], "id": doc["doc_id"], "source_type": "text"}
+            for doc in texts
+        ]
         return corpus, doc_id
 
 
 def component_article_url(container, doc_id):
     """Draw the Article URL widget"""
     with container:
-        urls = []
+        entered = []
         with st.expander("Enter URLs"):
             while True:
                 url = st.text_input(f"URL {doc_id}", key=doc_id)
                 if url != "":
-                    urls.append({"text": extract_text_from_url(url), "doc_id": doc_id})
+                    entered.append({"url": url, "doc_id": doc_id})
                     doc_id += 1
                     st.markdown("---")
                 else:
                     break
 
-        for idx, doc in enumerate(urls):
-            with st.expander(f"Preview URL {idx}"):
-                st.write(doc["text"])
-
-        corpus = [{"text": doc["text"], "id": doc["doc_id"]} for doc in urls]
+        # Articles are fetched by the indexing job, so typing here never waits on the network
+        corpus = [
+            {"url": doc["url"], "id": doc["doc_id"], "source_type": "url"}
+            for doc in entered
+        ]
         return corpus, doc_id
 
 
@@ -175,20 +200,103 @@ def component_file_input(container, doc_id):
                 file = st.file_uploader(
                     "Upload a .txt, .pdf, .csv, image file, audio file", key=doc_id
                 )
-                if file is not None:
-                    extracted_text = extract_text_from_file(file)
-                    if extracted_text is not None:
-                        files.append({"text": extracted_text, "doc_id": doc_id})
-                        doc_id += 1
-                        st.markdown("---")
-                    else:
-                        break
+                if file is not None and file.type in file_source_types:
+                    # Text is extracted by the indexing job, OCR and transcription take a while
+                    files.append(
+                        {
+                            "data": file.getvalue(),
+                            "file_type": file.type,
+                            "name": file.name,
+                            "doc_id": doc_id,
+                            "source_type": file_source_types[file.type],
+                        }
+                    )
+                    doc_id += 1
+                    st.markdown("---")
                 else:
+                    if file is not None:
+                        st.warning(f"File type {file.type} not supported")
                     break
 
-        for idx, doc in enumerate(files):
-            with st.expander(f"Preview File {idx}"):
-                st.write(doc["text"])
-
-        corpus = [{"text": doc["text"], "id": doc["doc_id"]} for doc in files]
+        corpus = [
+            {
+                "data": doc["data"],
+                "file_type": doc["file_type"],
+                "name": doc["name"],
+                "id": doc["doc_id"],
+                "source_type": doc["source_type"],
+            }
+            for doc in files
+        ]
         return corpus, doc_id
+
+
+def component_snapshots(container):
+    """Draw the Save / Restore snapshot widget"""
+    with container:
+        st.header("Snapshots")
+        index_pipeline = st.session_state["pipeline"]["index_pipeline"]
+        snapshot_name = st.text_input("Snapshot name", "default")
+        if st.button("Save snapshot") and snapshot_name != "":
+            with st.spinner("Saving snapshot..."):
+                try:
+                    manifest = save_snapshot(index_pipeline, snapshot_name)
+                except (ValueError, RuntimeError) as e:
+                    st.error(str(e))
+                else:
+                    st.success(
+                        f"{manifest['num_documents']} documents saved to snapshot"
+                    )
+
+        snapshots = list_snapshots()
+        if len(snapshots) > 0:
+            selected_snapshot = st.selectbox("Restore snapshot", snapshots)
+            if st.button("Restore"):
+                with st.spinner("Restoring snapshot..."):
+                    try:
+                        manifest = load_snapshot(index_pipeline, selected_snapshot)
+                    except (ValueError, FileNotFoundError) as e:
+                        st.error(str(e))
+                    else:
+                        st.session_state["search_results"] = None
+                        # Documents entered next must not reuse the restored ids
+                        st.session_state["doc_id"] = max(
+                            st.session_state["doc_id"], manifest["next_doc_id"]
+                        )
+                        st.success(
+                            f"{manifest['num_documents']} documents restored from snapshot"
+                        )
+
+
+def component_index_job(container, job_id):
+    """Draw the status of a background indexing job"""
+    job = get_indexing_queue().get(job_id)
+    if job is None:
+        return
+    with container:
+        if not job.finished:
+            _component_index_job_progress(job_id)
+        elif job.status == "done":
+            st.success(f"{len(job.result)} documents indexed successfully!")
+        elif job.status == "cancelled":
+            st.warning("Indexing cancelled")
+        else:
+            st.error(f"Indexing failed: {job.error}")
+        if job.finished:
+            for warning in job.warnings:
+                st.warning(warning)
+
+
+@st.fragment(run_every=1)
+def _component_index_job_progress(job_id):
+    queue = get_indexing_queue()
+    job = queue.get(job_id)
+    if job.finished:
+        # Rerun the whole page to draw the final status and stop polling
+        st.rerun()
+    if job.status == "queued":
+        st.info("Waiting for other indexing jobs to finish...")
+    for stage, fraction in job.progress.items():
+        st.progress(fraction, text=stage.capitalize())
+    if st.button("Cancel indexing"):
+        queue.cancel(job_id)
@@ -6,6 +6,8 @@ session_state_variables = {
     "pipeline_func_parameters": [],
     "search_results": None,
     "doc_id": 0,
+    "index_job": None,
+    "fetched_articles": {},
 }
 
 # Define Pages for the demo
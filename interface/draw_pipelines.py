@@ -1,19 +1,30 @@
-import math
-from typing import List
-from itertools import chain
+from functools import lru_cache
+
 import networkx as nx
 import plotly.graph_objs as go
 import numpy as np
 
 
 def get_pipeline_graph(pipeline):
+    """Get the Plotly figure of the pipeline, drawn once per pipeline topology"""
+    G = pipeline.graph
+    nodes = tuple((node, G.nodes[node]["component"].name) for node in G.nodes())
+    edges = tuple(G.edges())
+    return _draw_pipeline_graph(nodes, edges)
+
+
+@lru_cache(maxsize=32)
+def _draw_pipeline_graph(nodes, edges):
     # Controls for how the graph is drawn
     nodeColor = "#ffbf00"
     nodeSize = 40
     lineWidth = 2
     lineColor = "#ffffff"
 
-    G = pipeline.graph
+    G = nx.DiGraph()
+    G.add_nodes_from(node for node, _ in nodes)
+    G.add_edges_from(edges)
+    node_name = [name for _, name in nodes]
     current_coordinate = (0, len(set([edge[0] for edge in G.edges()])) + 1)
     # Transform G.edges into {node : all_connected_nodes} format
     node_connections = {}
@@ -56,37 +67,33 @@ def get_pipeline_graph(pipeline):
                 [current_coordinate[0], current_coordinate[1]]
             )
     pos = nx.spring_layout(G, pos=fixed_pos_nodes, fixed=G.nodes(), seed=42)
-    for node in G.nodes:
-        G.nodes[node]["pos"] = list(pos[node])
 
     # Make list of nodes for plotly
-    node_x = []
-    node_y = []
-    node_name = []
-    for node in G.nodes():
-        node_name.append(G.nodes[node]["component"].name)
-        x, y = G.nodes[node]["pos"]
-        node_x.append(x)
-        node_y.append(y)
-
-    # Make a list of edges for plotly, including line segments that result in arrowheads
-    edge_x = []
-    edge_y = []
-    for edge in G.edges():
-        start = G.nodes[edge[0]]["pos"]
-        end = G.nodes[edge[1]]["pos"]
-        # addEdge(start, end, edge_x, edge_y, lengthFrac=1, arrowPos = None, arrowLength=0.025, arrowAngle = 30, dotSize=20)
-        edge_x, edge_y = addEdge(
-            start,
-            end,
-            edge_x,
-            edge_y,
-            lengthFrac=0.5,
-            arrowPos="end",
-            arrowLength=0.04,
-            arrowAngle=40,
-            dotSize=nodeSize,
-        )
+    node_x = [pos[node][0] for node in G.nodes()]
+    node_y = [pos[node][1] for node in G.nodes()]
+
+    # Make the edges for plotly in one pass, including line segments that result in arrowheads
+    source = np.array([pos[edge[0]] for edge in G.edges()], dtype=float).reshape(-1, 2)
+    target = np.array([pos[edge[1]] for edge in G.edges()], dtype=float).reshape(-1, 2)
+    source_x, target_x, source_y, target_y = shorten_edges(
+        source[:, 0],
+        target[:, 0],
+        source[:, 1],
+        target[:, 1],
+        lengthFrac=0.5,
+        dotSize=nodeSize,
+    )
+    arrow_x, arrow_y = add_arrows(
+        source_x,
+        target_x,
+        source_y,
+        target_y,
+        arrowPos="end",
+        arrowLength=0.04,
+        arrowAngle=40,
+    )
+    edge_x = np.concatenate([_segments(source_x, target_x), arrow_x])
+    edge_y = np.concatenate([_segments(source_y, target_y), arrow_y])
 
     edge_trace = go.Scatter(
         x=edge_x,
@@ -125,138 +132,68 @@ def get_pipeline_graph(pipeline):
     return fig
 
 
-def addEdge(
-    start,
-    end,
-    edge_x,
-    edge_y,
+def _segments(start, end):
+    """Interleave start and end coordinates with NaN so Plotly draws separate segments"""
+    return np.column_stack([start, end, np.full(len(start), np.nan)]).ravel()
+
+
+def shorten_edges(
+    source_x: np.ndarray,
+    target_x: np.ndarray,
+    source_y: np.ndarray,
+    target_y: np.ndarray,
     lengthFrac=1,
-    arrowPos=None,
-    arrowLength=0.025,
-    arrowAngle=30,
     dotSize=20,
 ):
-
-    # Get start and end cartesian coordinates
-    x0, y0 = start
-    x1, y1 = end
-
     # Incorporate the fraction of this segment covered by a dot into total reduction
-    length = math.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
+    length = np.hypot(target_x - source_x, target_y - source_y)
     dotSizeConversion = 0.0565 / 20  # length units per dot size
     convertedDotDiameter = dotSize * dotSizeConversion
-    lengthFracReduction = convertedDotDiameter / length
-    lengthFrac = lengthFrac - lengthFracReduction
+    lengthFrac = lengthFrac - convertedDotDiameter / length
 
     # If the line segment should not cover the entire distance, get actual start and end coords
-    skipX = (x1 - x0) * (1 - lengthFrac)
-    skipY = (y1 - y0) * (1 - lengthFrac)
-    x0 = x0 + skipX / 2
-    x1 = x1 - skipX / 2
-    y0 = y0 + skipY / 2
-    y1 = y1 - skipY / 2
-
-    # Append line corresponding to the edge
-    edge_x.append(x0)
-    edge_x.append(x1)
-    edge_x.append(
-        None
-    )  # Prevents a line being drawn from end of this edge to start of next edge
-    edge_y.append(y0)
-    edge_y.append(y1)
-    edge_y.append(None)
-
-    # Draw arrow
-    if not arrowPos == None:
-
-        # Find the point of the arrow; assume is at end unless told middle
-        pointx = x1
-        pointy = y1
-
-        eta = math.degrees(math.atan((x1 - x0) / (y1 - y0))) if y1 != y0 else 90.0
-
-        if arrowPos == "middle" or arrowPos == "mid":
-            pointx = x0 + (x1 - x0) / 2
-            pointy = y0 + (y1 - y0) / 2
-
-        # Find the directions the arrows are pointing
-        signx = (x1 - x0) / abs(x1 - x0) if x1 != x0 else +1  # verify this once
-        signy = (y1 - y0) / abs(y1 - y0) if y1 != y0 else +1  # verified
-
-        # Append first arrowhead
-        dx = arrowLength * math.sin(math.radians(eta + arrowAngle))
-        dy = arrowLength * math.cos(math.radians(eta + arrowAngle))
-        edge_x.append(pointx)
-        edge_x.append(pointx - signx**2 * signy * dx)
-        edge_x.append(None)
-        edge_y.append(pointy)
-        edge_y.append(pointy - signx**2 * signy * dy)
-        edge_y.append(None)
-
-        # And second arrowhead
-        dx = arrowLength * math.sin(math.radians(eta - arrowAngle))
-        dy = arrowLength * math.cos(math.radians(eta - arrowAngle))
-        edge_x.append(pointx)
-        edge_x.append(pointx - signx**2 * signy * dx)
-        edge_x.append(None)
-        edge_y.append(pointy)
-        edge_y.append(pointy - signx**2 * signy * dy)
-        edge_y.append(None)
-
-    return edge_x, edge_y
+    skipX = (target_x - source_x) * (1 - lengthFrac)
+    skipY = (target_y - source_y) * (1 - lengthFrac)
+    return (
+        source_x + skipX / 2,
+        target_x - skipX / 2,
+        source_y + skipY / 2,
+        target_y - skipY / 2,
+    )
 
 
 def add_arrows(
-    source_x: List[float],
-    target_x: List[float],
-    source_y: List[float],
-    target_y: List[float],
+    source_x: np.ndarray,
+    target_x: np.ndarray,
+    source_y: np.ndarray,
+    target_y: np.ndarray,
+    arrowPos="middle",
     arrowLength=0.025,
     arrowAngle=30,
 ):
-    pointx = list(map(lambda x: x[0] + (x[1] - x[0]) / 2, zip(source_x, target_x)))
-    pointy = list(map(lambda x: x[0] + (x[1] - x[0]) / 2, zip(source_y, target_y)))
-    etas = list(
-        map(
-            lambda x: math.degrees(math.atan((x[1] - x[0]) / (x[3] - x[2]))),
-            zip(source_x, target_x, source_y, target_y),
-        )
-    )
-
-    signx = list(
-        map(lambda x: (x[1] - x[0]) / abs(x[1] - x[0]), zip(source_x, target_x))
-    )
-    signy = list(
-        map(lambda x: (x[1] - x[0]) / abs(x[1] - x[0]), zip(source_y, target_y))
-    )
-
-    dx = list(map(lambda x: arrowLength * math.sin(math.radians(x + arrowAngle)), etas))
-    dy = list(map(lambda x: arrowLength * math.cos(math.radians(x + arrowAngle)), etas))
-    none_spacer = [None for _ in range(len(pointx))]
-    arrow_line_x = list(
-        map(lambda x: x[0] - x[1] ** 2 * x[2] * x[3], zip(pointx, signx, signy, dx))
-    )
-    arrow_line_y = list(
-        map(lambda x: x[0] - x[1] ** 2 * x[2] * x[3], zip(pointy, signx, signy, dy))
-    )
-
-    arrow_line_1x_coords = list(chain(*zip(pointx, arrow_line_x, none_spacer)))
-    arrow_line_1y_coords = list(chain(*zip(pointy, arrow_line_y, none_spacer)))
-
-    dx = list(map(lambda x: arrowLength * math.sin(math.radians(x - arrowAngle)), etas))
-    dy = list(map(lambda x: arrowLength * math.cos(math.radians(x - arrowAngle)), etas))
-    none_spacer = [None for _ in range(len(pointx))]
-    arrow_line_x = list(
-        map(lambda x: x[0] - x[1] ** 2 * x[2] * x[3], zip(pointx, signx, signy, dx))
-    )
-    arrow_line_y = list(
-        map(lambda x: x[0] - x[1] ** 2 * x[2] * x[3], zip(pointy, signx, signy, dy))
-    )
-
-    arrow_line_2x_coords = list(chain(*zip(pointx, arrow_line_x, none_spacer)))
-    arrow_line_2y_coords = list(chain(*zip(pointy, arrow_line_y, none_spacer)))
-
-    x_arrows = arrow_line_1x_coords + arrow_line_2x_coords
-    y_arrows = arrow_line_1y_coords + arrow_line_2y_coords
-
-    return x_arrows, y_arrows
+    # Find the point of the arrow; at the end unless told middle
+    if arrowPos == "middle" or arrowPos == "mid":
+        pointx = source_x + (target_x - source_x) / 2
+        pointy = source_y + (target_y - source_y) / 2
+    else:
+        pointx = target_x
+        pointy = target_y
+
+    delta_x = target_x - source_x
+    delta_y = target_y - source_y
+    with np.errstate(divide="ignore", invalid="ignore"):
+        etas = np.where(delta_y != 0, np.degrees(np.arctan(delta_x / delta_y)), 90.0)
+
+    # Find the directions the arrows are pointing
+    signx = np.where(delta_x != 0, np.sign(delta_x), 1.0)
+    signy = np.where(delta_y != 0, np.sign(delta_y), 1.0)
+
+    x_arrows = []
+    y_arrows = []
+    for angle in (arrowAngle, -arrowAngle):
+        dx = arrowLength * np.sin(np.radians(etas + angle))
+        dy = arrowLength * np.cos(np.radians(etas + angle))
+        x_arrows.append(_segments(pointx, pointx - signx**2 * signy * dx))
+        y_arrows.append(_segments(pointy, pointy - signx**2 * signy * dy))
+
+    return np.concatenate(x_arrows), np.concatenate(y_arrows)
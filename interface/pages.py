@@ -1,13 +1,25 @@
+import asyncio
+import functools
+
 import streamlit as st
 from streamlit_option_menu import option_menu
-from core.search_index import index, search
+from core.filtering import source_types
+from core.search_index import search_stream
 from interface.components import (
     component_file_input,
+    component_index_job,
     component_show_pipeline,
     component_show_search_result,
+    component_snapshots,
     component_text_input,
     component_article_url,
 )
+from interface.utils import (
+    extract_documents,
+    get_indexing_queue,
+    profiling_requested,
+    resumable_index_job,
+)
 
 
 def page_landing_page(container):
@@ -44,21 +56,44 @@ def page_search(container):
 
         ## SEARCH ##
         query = st.text_input("Query")
+        selected_source_types = st.multiselect("Source types", source_types)
 
         component_show_pipeline(st.session_state["pipeline"], "search_pipeline")
 
+        results_placeholder = st.empty()
         if st.button("Search"):
-            with st.spinner("Searching..."):
-                st.session_state["search_results"] = search(
-                    queries=[query],
-                    pipeline=st.session_state["pipeline"]["search_pipeline"],
+            asyncio.run(
+                _stream_search_results(
+                    results_placeholder,
+                    query,
+                    filters=(
+                        {"source_type": selected_source_types}
+                        if selected_source_types
+                        else None
+                    ),
                 )
-        if st.session_state["search_results"] is not None:
+            )
+        elif st.session_state["search_results"] is not None:
             component_show_search_result(
-                container=container, results=st.session_state["search_results"][0]
+                container=results_placeholder.container(),
+                results=st.session_state["search_results"][0],
             )
 
 
+async def _stream_search_results(placeholder, query, filters=None):
+    """Draw the search results each time a pipeline stage refines them."""
+    placeholder.info("Searching...")
+    async for stage, results in search_stream(
+        queries=[query],
+        pipeline=st.session_state["pipeline"]["search_pipeline"],
+        filters=filters,
+    ):
+        st.session_state["search_results"] = results
+        container = placeholder.container()
+        container.caption(f"Results from {stage}")
+        component_show_search_result(container=container, results=results[0])
+
+
 def page_index(container):
     with container:
         st.title("Index time!")
@@ -80,18 +115,38 @@ def page_index(container):
         )
 
         clear_index = st.sidebar.checkbox("Clear Index", True)
+        component_snapshots(st.sidebar)
 
         doc_id = st.session_state["doc_id"]
         corpus, doc_id = input_funcs[selected_input][0](container, doc_id)
 
         if len(corpus) > 0:
-            index_results = None
             if st.button("Index"):
-                with st.spinner("Indexing..."):
-                    index_results = index(
-                        documents=corpus,
-                        pipeline=st.session_state["pipeline"]["index_pipeline"],
-                        clear_index=clear_index,
-                    )
-                    st.session_state["doc_id"] = doc_id
-                st.success(f"{len(index_results)} documents indexed successfully!")
+                job_id = get_indexing_queue().submit(
+                    documents=corpus,
+                    pipeline=st.session_state["pipeline"]["index_pipeline"],
+                    clear_index=clear_index,
+                    profile=profiling_requested(),
+                    extract=functools.partial(
+                        extract_documents,
+                        audio_model=st.session_state["audio_model"],
+                        fetched=st.session_state["fetched_articles"],
+                    ),
+                )
+                st.session_state["doc_id"] = doc_id
+                st.session_state["index_job"] = job_id
+                st.query_params["index_job"] = job_id
+
+        job_id = st.session_state["index_job"]
+        if job_id is None and "index_job" in st.query_params:
+            # A reloaded tab picks its job up again when the job writes to a store this
+            # session uses, e.g. the one Keyword Search shares, other stores are out of reach
+            job_id = resumable_index_job(
+                st.query_params["index_job"],
+                st.session_state["pipeline"]["index_pipeline"],
+            )
+            st.session_state["index_job"] = job_id
+            if job_id is None:
+                st.query_params.pop("index_job", None)
+        if job_id is not None:
+            component_index_job(container, job_id)
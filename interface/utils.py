@@ -1,23 +1,38 @@
 import os
 import shutil
 from inspect import getmembers, isfunction, signature
-from io import StringIO
+from io import BytesIO, StringIO
 
 import pandas as pd
 import pytesseract
 import streamlit as st
-from newspaper import Article
+from haystack.document_stores import BaseDocumentStore
 from PIL import Image
 from PyPDF2 import PdfFileReader
 
 import core.pipelines as pipelines_functions
 from core.audio import audio_to_text, load_model
-from core.pipelines import data_path
+from core.fetch import ArticleFetcher
+from core.jobs import IndexingJobQueue
+from core.pipelines import cache_path, data_path
+from core.tracing import profiling_enabled, span
+
+
+def profiling_requested():
+    """Whether this rerun should be traced, from the environment or the `?profile=1` query parameter."""
+    return profiling_enabled() or st.query_params.get("profile") == "1"
 
 
 def get_pipelines():
     pipeline_names, pipeline_funcs = list(
-        zip(*getmembers(pipelines_functions, isfunction))
+        zip(
+            *getmembers(
+                pipelines_functions,
+                # Leave out the helpers core.pipelines imports
+                lambda member: isfunction(member)
+                and member.__module__ == pipelines_functions.__name__,
+            )
+        )
     )
     pipeline_names = [
         " ".join([n.capitalize() for n in name.split("_")]) for name in pipeline_names
@@ -29,29 +44,96 @@ def get_pipelines():
     return pipeline_names, pipeline_funcs, pipeline_func_parameters
 
 
-def reset_vars_data():
+def reset_vars_data(keep_index_job=False):
     st.session_state["doc_id"] = 0
     st.session_state["search_results"] = None
+    st.session_state["index_job"] = None
+    if not keep_index_job:
+        st.query_params.pop("index_job", None)
     # Delete data files
     shutil.rmtree(data_path)
     os.makedirs(data_path, exist_ok=True)
 
 
-@st.cache_data
-def extract_text_from_url(url: str):
-    article = Article(url)
-    article.download()
-    article.parse()
-
-    return article.text
-
-
-@st.cache_data
-def extract_text_from_file(file):
+article_fetcher = ArticleFetcher(cache_path=os.path.join(cache_path, "articles"))
+
+
+def extract_texts_from_urls(urls):
+    """Fetch the articles at `urls` in bulk, see `core.fetch.ArticleFetcher`."""
+    return article_fetcher.fetch(urls)
+
+
+def extract_documents(
+    documents, progress_callback, warning_callback, audio_model=None, fetched=None
+):
+    """
+    Texts of the inputs entered on the Index page, run by their indexing job as its extract stage.
+
+    Inputs have either a `text`, a `url` or the `data` and `file_type` of an uploaded file.
+    Those that cannot be read are left out and reported to `warning_callback`.
+    `fetched` maps the URLs already fetched in the session to their text, and new ones are added to it.
+    """
+    fetched = fetched if fetched is not None else {}
+    texts = {}
+    urls = []
+    for url in dict.fromkeys(doc["url"] for doc in documents if "url" in doc):
+        if url in fetched:
+            texts[url] = fetched[url]
+        else:
+            urls.append(url)
+    if urls:
+        with span("extract", source_type="url", urls=len(urls)):
+            articles = extract_texts_from_urls(urls)
+        for article in articles:
+            if article["error"] is not None:
+                warning_callback(
+                    f"Could not fetch {article['url']}: {article['error']}"
+                )
+            else:
+                texts[article["url"]] = fetched[article["url"]] = article["text"]
+    extracted = []
+    done = len([doc for doc in documents if "url" in doc])
+    progress_callback(done / len(documents))
+    for doc in documents:
+        if "url" in doc:
+            text = texts.get(doc["url"])
+        elif "data" in doc:
+            with span("extract", source_type=doc["source_type"]):
+                text = extract_text_from_file(
+                    doc["file_type"], doc["data"], audio_model
+                )
+            if text is None:
+                warning_callback(f"Could not read {doc['name']}")
+            done += 1
+            progress_callback(done / len(documents))
+        else:
+            text = doc["text"]
+        if text is not None:
+            extracted.append(
+                {"text": text, "id": doc["id"], "source_type": doc["source_type"]}
+            )
+    return extracted
+
+
+file_source_types = {
+    "text/plain": "text",
+    "application/pdf": "pdf",
+    "text/csv": "csv",
+    "image/jpeg": "image",
+    "image/png": "image",
+    "audio/mpeg": "audio",
+    "audio/wav": "audio",
+    "audio/aac": "audio",
+    "audio/x-m4a": "audio",
+}
+
+
+def extract_text_from_file(file_type, data, audio_model=None):
+    file = BytesIO(data)
     # read text file
-    if file.type == "text/plain":
+    if file_type == "text/plain":
         # To convert to a string based IO:
-        stringio = StringIO(file.getvalue().decode("utf-8"))
+        stringio = StringIO(data.decode("utf-8"))
 
         # To read file as string:
         file_text = stringio.read()
@@ -59,7 +141,7 @@ def extract_text_from_file(file):
         return file_text
 
     # read pdf file
-    elif file.type == "application/pdf":
+    elif file_type == "application/pdf":
         pdfReader = PdfFileReader(file)
         count = pdfReader.numPages
         all_text = ""
@@ -75,7 +157,7 @@ def extract_text_from_file(file):
         return file_text
 
     # read csv file
-    elif file.type == "text/csv":
+    elif file_type == "text/csv":
         csv = pd.read_csv(file)
         # get columns of type string
         string_columns = csv.select_dtypes(include=["object"]).columns
@@ -99,19 +181,36 @@ def extract_text_from_file(file):
         return file_text
 
     # read image file (OCR)
-    elif file.type in ["image/jpeg", "image/png"]:
+    elif file_type in ["image/jpeg", "image/png"]:
         return pytesseract.image_to_string(Image.open(file))
 
     # read audio file (AudoToText)
-    elif file.type in ["audio/mpeg", "audio/wav", "audio/aac", "audio/x-m4a"]:
-        text = audio_to_text(st.session_state["audio_model"], file)
+    elif file_type in ["audio/mpeg", "audio/wav", "audio/aac", "audio/x-m4a"]:
+        text = audio_to_text(audio_model, file)
         return text
 
     else:
-        st.warning(f"File type {file.type} not supported")
         return None
 
 
 @st.cache_resource
 def load_audio_model():
     return load_model()
+
+
+@st.cache_resource
+def get_indexing_queue():
+    # One queue per server process, so concurrent sessions do not compete for the same threads
+    return IndexingJobQueue(max_workers=1)
+
+
+def resumable_index_job(job_id, index_pipeline):
+    """`job_id` if that indexing job writes to a document store of `index_pipeline`, otherwise None."""
+    job = get_indexing_queue().get(job_id)
+    if job is None:
+        return None
+    stores = index_pipeline.get_nodes_by_class(class_type=BaseDocumentStore)
+    job_stores = job.pipeline.get_nodes_by_class(class_type=BaseDocumentStore)
+    if any(store is job_store for store in stores for job_store in job_stores):
+        return job_id
+    return None
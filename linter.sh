@@ -1 +1 @@
-python -m black app.py interface core
\ No newline at end of file
+python -m black app.py interface core benchmarks
\ No newline at end of file